@@ -10,6 +10,7 @@ from .models import (
     Condition,
     Category,
     Banner,
+    OutgoingEmail,
 )
 
 
@@ -97,3 +98,13 @@ class CityAdmin(admin.ModelAdmin):
 @admin.register(Condition)
 class ConditionAdmin(admin.ModelAdmin):
     list_display = ('pk', 'name')
+
+
+@admin.register(OutgoingEmail)
+class OutgoingEmailAdmin(admin.ModelAdmin):
+    list_display = (
+        'pk', 'to', 'subject', 'created_at', 'sent_at', 'failed_at',
+        'attempts',
+    )
+    list_filter = ('sent_at', 'failed_at')
+    search_fields = ('to',)
@@ -0,0 +1,348 @@
+"""
+Замеры производительности. Имя модуля не подходит под test*.py,
+поэтому в обычный прогон тестов он не попадает, запускаем явно:
+
+    python manage.py test api.benchmarks
+
+Число строк задают BENCHMARK_ROWS (пагинация), BENCHMARK_CATEGORY_ROWS
+(товары в категории) и BENCHMARK_SUGGEST_ROWS (подсказки), число
+повторов - BENCHMARK_REPEAT.
+Результаты печатаются, на время замеры не проверяют.
+"""
+import gc
+import os
+import random
+import statistics
+import tempfile
+import time
+from datetime import timedelta
+from pathlib import Path
+from unittest import mock
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from .fastpath import render_category
+from .images import get_formats
+from .imaging import variant_name
+from .models import (
+    Category,
+    Collection,
+    Product,
+    ProductCategory,
+    ProductProperty,
+    ProductSize,
+    Property,
+    Size,
+)
+from .pagination import ProductPagination
+from .prefetch import plan_for
+from .renderers import ORJSONRenderer
+from .serializers import CategorySerializer
+from .sprites import rebuild_sprite
+from .suggest import SuggestIndex, get_suggest_version
+
+ROWS = int(os.environ.get('BENCHMARK_ROWS', 100_000))
+
+CATEGORY_ROWS = int(os.environ.get('BENCHMARK_CATEGORY_ROWS', 5000))
+
+SUGGEST_ROWS = int(os.environ.get('BENCHMARK_SUGGEST_ROWS', 20_000))
+
+REPEAT = int(os.environ.get('BENCHMARK_REPEAT', 20))
+
+# Слова названий для подсказок, в названии три слова и номер
+SUGGEST_WORDS = (
+    'пицца', 'пепперони', 'маргарита', 'четыре', 'сыра', 'ролл',
+    'филадельфия', 'калифорния', 'запеченный', 'острый', 'суп',
+    'том', 'ям', 'лосось', 'угорь', 'креветка', 'курица', 'бекон',
+    'грибы', 'ветчина', 'салат', 'цезарь', 'греческий', 'сет',
+    'большой', 'детский', 'соус', 'сырный', 'чесночный', 'напиток',
+)
+
+# Запрос -> что проверяет
+SUGGEST_QUERIES = (
+    ('пиц', 'начало слова'),
+    ('пицца', 'слово'),
+    ('пица', 'опечатка'),
+    ('ролл фил', 'два слова'),
+    ('лосось угорь сет', 'три слова'),
+    ('бургер', 'нет товаров'),
+)
+
+SVG_ICON = (
+    b'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 16 16">'
+    b'<circle cx="8" cy="8" r="8"/></svg>'
+)
+
+
+def measure(func, repeat=REPEAT):
+    """
+    Медиана времени вызова в миллисекундах, первый вызов прогревает.
+    Сборщик мусора на время замера выключен, как в timeit.
+    """
+
+    func()
+    timings = []
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - start)
+    finally:
+        gc.enable()
+    return statistics.median(timings) * 1000
+
+
+def report(title, header, rows):
+    print(f'\n{title}')
+    print(''.join(f'{column:>14}' for column in header))
+    for row in rows:
+        print(''.join(
+            f'{value:>14.2f}' if isinstance(value, float)
+            else f'{value:>14}'
+            for value in row
+        ))
+
+
+def touch(name, content=b''):
+    path = Path(default_storage.path(name))
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(content)
+
+
+def create_products(count):
+    # Время задаем сами, по три товара с одинаковым временем, чтобы
+    # порядок решал id. UPDATE после вставки оставил бы в начале
+    # индекса мертвые строки и исказил бы первую страницу
+    now = timezone.now()
+    created_at = Product._meta.get_field('created_at')
+    with mock.patch.object(created_at, 'auto_now_add', False):
+        Product.objects.bulk_create(
+            (
+                Product(
+                    name=f'товар {i}',
+                    created_at=now - timedelta(seconds=i // 3),
+                )
+                for i in range(count)
+            ),
+            batch_size=5000,
+        )
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE api_product')
+
+
+def create_category(count):
+    """
+    Категория pizza с count товарами: у каждого два размера и
+    свойство, каждый десятый - набор из двух соседних товаров.
+    """
+
+    category = Category.objects.create(
+        slug='pizza', name='Пицца', image='categories/images/a.jpg')
+    small = Size.objects.create(size=4, measurement='шт')
+    big = Size.objects.create(size=8, measurement='шт')
+    hot = Property.objects.create(
+        slug='hot', name='Острое', icon='properties/images/hot.svg')
+
+    products = Product.objects.bulk_create(
+        Product(
+            name=f'товар {i}',
+            description='Описание',
+            discount=10 if i % 2 else None,
+            calorie=100 + i,
+            image='products/images/x.jpg' if i % 3 else '',
+        )
+        for i in range(count)
+    )
+    ProductCategory.objects.bulk_create(
+        ProductCategory(product=product, category=category)
+        for product in products
+    )
+    ProductSize.objects.bulk_create(
+        ProductSize(product=product, size=size, price=price, weight=200)
+        for product in products
+        for size, price in ((small, 333), (big, 555))
+    )
+    ProductProperty.objects.bulk_create(
+        ProductProperty(product=product, property=hot)
+        for product in products
+    )
+    Collection.objects.bulk_create(
+        Collection(
+            parent_product=products[i],
+            child_product=products[i + offset],
+            is_full=bool(offset % 2),
+        )
+        for i in range(0, count - 2, 10)
+        for offset in (1, 2)
+    )
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class PaginationBenchmark(TestCase):
+    """
+    Страница товаров на разной глубине: с курсором время не растет,
+    OFFSET для сравнения растет вместе с номером страницы.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        create_products(ROWS)
+
+    def setUp(self):
+        rebuild_sprite()
+        self.client = APIClient()
+        self.pagination = ProductPagination()
+        self.pagination.base_url = 'http://testserver/api/v1/products/'
+        self.ordering = self.pagination.ordering
+        self.page_size = self.pagination.page_size
+
+    def keyset_queryset(self, depth):
+        queryset = Product.objects.order_by(*self.ordering)
+        if not depth:
+            return queryset, self.pagination.base_url
+        values = self.pagination.get_row_values(queryset[depth - 1])
+        queryset = queryset.filter(
+            self.pagination.keyset_filter(self.ordering, values))
+        return queryset, self.pagination.cursor_link(False, values)
+
+    def test_page_depth(self):
+        size = self.page_size + 1
+        rows = []
+        for depth in (0, ROWS // 2, ROWS - self.page_size):
+            queryset, url = self.keyset_queryset(depth)
+            self.assertEqual(self.client.get(url).status_code, 200)
+
+            page = measure(lambda: self.client.get(url))
+            keyset = measure(lambda: list(queryset[:size]))
+            offset = measure(lambda: list(
+                Product.objects.order_by(*self.ordering)[depth:depth + size]
+            ))
+            rows.append((depth, page, keyset, offset))
+
+        report(
+            f'Страница товаров, {ROWS} строк, мс',
+            ('глубина', 'страница', 'курсор', 'OFFSET'),
+            rows,
+        )
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class CategoryBenchmark(TestCase):
+    """
+    Меню категории на CATEGORY_ROWS товаров. Объекты загружены по
+    prefetch плану заранее, запросы в замеры не входят.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        create_category(CATEGORY_ROWS)
+
+    def setUp(self):
+        # Иконка и варианты картинок уже на диске, как на рабочем
+        # сервере: srcset берется из кеша, а не проверяется по диску
+        touch('properties/images/hot.svg', SVG_ICON)
+        for name in ('categories/images/a.jpg', 'products/images/x.jpg'):
+            for fmt in get_formats():
+                for width in settings.IMAGE_VARIANT_WIDTHS:
+                    touch(variant_name(name, width, fmt))
+        rebuild_sprite()
+        queryset = plan_for(CategorySerializer).apply(Category.objects.all())
+        self.category = queryset.get(slug='pizza')
+
+
+class SerializationBenchmark(CategoryBenchmark):
+    """
+    Объектов в секунду: быстрый путь api.fastpath против
+    CategorySerializer на одних и тех же объектах.
+    """
+
+    def test_category(self):
+        renderer = ORJSONRenderer()
+        self.assertEqual(
+            renderer.render(render_category(self.category)),
+            renderer.render(CategorySerializer(self.category).data),
+        )
+
+        rows = []
+        for name, func in (
+            ('serializer', lambda: CategorySerializer(self.category).data),
+            ('fastpath', lambda: render_category(self.category)),
+        ):
+            elapsed = measure(func, repeat=max(REPEAT // 4, 1))
+            rows.append((name, elapsed, CATEGORY_ROWS / elapsed * 1000))
+
+        report(
+            f'Меню категории, {CATEGORY_ROWS} товаров',
+            ('', 'мс', 'объектов/с'),
+            rows,
+        )
+
+
+class RendererBenchmark(CategoryBenchmark):
+    """
+    ORJSONRenderer против JSONRenderer DRF на готовом меню категории.
+    """
+
+    def test_render(self):
+        data = render_category(self.category)
+        rows = []
+        for name, renderer in (
+            ('drf', JSONRenderer()),
+            ('orjson', ORJSONRenderer()),
+        ):
+            size = len(renderer.render(data))
+            elapsed = measure(lambda: renderer.render(data))
+            rows.append((name, elapsed, size / elapsed / 1000))
+
+        report(
+            f'Рендер меню категории, {CATEGORY_ROWS} товаров',
+            ('', 'мс', 'МБ/с'),
+            rows,
+        )
+
+
+class SuggestBenchmark(TestCase):
+    """
+    Подсказки по SUGGEST_ROWS товарам: сборка индекса из базы и
+    время ответа на запросы разного вида.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        rng = random.Random(0)
+        Product.objects.bulk_create(
+            (
+                Product(name=' '.join((*rng.sample(SUGGEST_WORDS, 3), str(i))))
+                for i in range(SUGGEST_ROWS)
+            ),
+            batch_size=5000,
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def test_suggest(self):
+        index = SuggestIndex()
+        rows = [(
+            'сборка',
+            measure(lambda: index.load(get_suggest_version()), repeat=3),
+            len(index.names),
+        )]
+        for query, title in SUGGEST_QUERIES:
+            found = len(index.suggest(query, 10))
+            elapsed = measure(lambda: index.suggest(query, 10))
+            rows.append((title, elapsed, found))
+
+        report(
+            f'Подсказки, {SUGGEST_ROWS} товаров',
+            ('', 'мс', 'строк'),
+            rows,
+        )
@@ -0,0 +1,27 @@
+from django.conf import settings
+from django.core.checks import Tags, Warning, register
+
+LOCMEM_BACKEND = 'django.core.cache.backends.locmem.LocMemCache'
+
+
+@register(Tags.caches)
+def check_shared_cache(app_configs, **kwargs):
+    """
+    Версия каталога, снимки категорий и изменения индекса подсказок
+    лежат в кеше и должны быть видны всем процессам. LocMemCache
+    у каждого процесса свой: другие воркеры не узнают об изменениях
+    и отдают старые данные.
+    """
+
+    if settings.CACHES['default']['BACKEND'] != LOCMEM_BACKEND:
+        return []
+    return [
+        Warning(
+            'Кеш по умолчанию - LocMemCache, он не общий для процессов',
+            hint=('Если сервер запущен больше чем в одном процессе, '
+                  'укажите в CACHE_BACKEND общий кеш, например Redis '
+                  'или Memcached. Для одного процесса предупреждение '
+                  'отключается в SILENCED_SYSTEM_CHECKS.'),
+            id='api.W001',
+        )
+    ]
@@ -0,0 +1,56 @@
+import secrets
+
+from django.core.cache import cache
+
+from .backends import GuestUser
+
+CODE_TTL = 10 * 60
+MAX_CODE_ATTEMPTS = 5
+
+
+def get_code_key(user):
+    if isinstance(user, GuestUser):
+        return f'verification-code:guest:{user.guest_id}'
+    return f'verification-code:user:{user.pk}'
+
+
+def issue_code(user, email):
+    """
+    Новый код подтверждения для email. Код живет в кеше CODE_TTL
+    секунд, строка пользователя при этом не меняется.
+    """
+
+    code = f'{secrets.randbelow(10 ** 5):05d}'
+    key = get_code_key(user)
+    cache.set(key, {'email': email, 'code': code}, timeout=CODE_TTL)
+    cache.delete(f'{key}:attempts')
+    return code
+
+
+def verify_code(user, code):
+    """
+    Почта, на которую был отправлен код, или None, если код не совпал,
+    истек или попыток было больше MAX_CODE_ATTEMPTS. Верный код
+    срабатывает один раз.
+    """
+
+    key = get_code_key(user)
+    attempts_key = f'{key}:attempts'
+    # incr атомарный, поэтому параллельные запросы не обойдут лимит
+    cache.add(attempts_key, 0, timeout=CODE_TTL)
+    if cache.incr(attempts_key) > MAX_CODE_ATTEMPTS:
+        cache.delete(key)
+        return None
+
+    entry = cache.get(key)
+    # compare_digest со строками не ASCII бросает TypeError, байты
+    # сравниваются всегда
+    if entry is None or not secrets.compare_digest(
+            entry['code'].encode(), code.encode()):
+        return None
+    # Код достается тому, кто первым его удалил: параллельный запрос
+    # с тем же кодом получит False и не подтвердит почту второй раз
+    if not cache.delete(key):
+        return None
+    cache.delete(attempts_key)
+    return entry['email']
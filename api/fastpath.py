@@ -0,0 +1,139 @@
+"""
+Быстрая отрисовка меню категории без полей DRF.
+
+Функции повторяют CategorySerializer и вложенные в него сериализаторы
+поле в поле и в том же порядке ключей, но работают напрямую с уже
+загруженными по prefetch плану объектами. Общая логика полей берется
+из api.serializers, поэтому результат совпадает байт в байт.
+"""
+from .images import image_srcset
+from .serializers import (
+    format_amount,
+    format_component_name,
+    format_discount_price,
+    get_kpfc,
+)
+from .sprites import get_sprite_url, icon_sprite
+from .tags import get_category_tags
+
+
+def text(value):
+    return None if value is None else str(value)
+
+
+def integer(value):
+    return None if value is None else int(value)
+
+
+def media_or_none(file):
+    return file.url if file else None
+
+
+def render_image_info(obj, field='image'):
+    return {
+        f'{field}_width': integer(getattr(obj, f'{field}_width')),
+        f'{field}_height': integer(getattr(obj, f'{field}_height')),
+        f'{field}_placeholder': text(getattr(obj, f'{field}_placeholder')),
+    }
+
+
+def render_property(prop, sprite_url):
+    return {
+        'pk': prop.pk,
+        'name': text(prop.name),
+        'icon': media_or_none(prop.icon),
+        'icon_sprite': icon_sprite(prop, sprite_url),
+        **render_image_info(prop, 'icon'),
+    }
+
+
+def render_size(product_size):
+    size = product_size.size
+    return {
+        'pk': size.id,
+        'size': f'{size.size}{size.measurement}',
+        'price': f'{product_size.price}₽',
+        'discount_price': format_discount_price(product_size),
+        'weight': product_size.weight,
+    }
+
+
+def render_short_promotion(promotion):
+    if promotion is None:
+        return None
+    return {
+        'pk': promotion.pk,
+        'name': text(promotion.name),
+        'hex_color': text(promotion.hex_color),
+    }
+
+
+def render_component(collection):
+    product = collection.child_product
+    return {
+        'pk': product.id,
+        'name': format_component_name(collection),
+        'description': text(product.description),
+        'image': media_or_none(product.image),
+        'image_srcset': image_srcset(product.image),
+        **render_image_info(product),
+    }
+
+
+def render_category_product(product_category, sprite_url):
+    product = product_category.product
+    return {
+        'pk': product.pk,
+        'name': text(product.name),
+        'description': text(product.description),
+        'promotion': render_short_promotion(product.promotion),
+        'discount': integer(product.discount),
+        'total_weight': integer(product.total_weight),
+        'amount': format_amount(product),
+        'kpfc': get_kpfc(product),
+        'image': media_or_none(product.image),
+        'image_srcset': image_srcset(product.image),
+        **render_image_info(product),
+        'components': [
+            render_component(collection)
+            for collection in product.components.all()
+        ],
+        'properties': [
+            render_property(prop, sprite_url)
+            for prop in product.property.all()
+        ],
+        'sizes': [
+            render_size(product_size) for product_size in product.sizes.all()
+        ],
+    }
+
+
+def render_banner(banner):
+    return {
+        'pk': banner.pk,
+        'title': text(banner.title),
+        'description': text(banner.description),
+        'image': banner.image.url,
+        'image_srcset': image_srcset(banner.image),
+        **render_image_info(banner),
+        'slug': text(banner.slug),
+    }
+
+
+def render_category(category):
+    sprite_url = get_sprite_url()
+    return {
+        'pk': category.pk,
+        'name': text(category.name),
+        'description': text(category.description),
+        'slug': text(category.slug),
+        'image': category.image.url,
+        'image_srcset': image_srcset(category.image),
+        **render_image_info(category),
+        'banners': [render_banner(banner) for banner in category.banner.all()],
+        'products': [
+            render_category_product(product_category, sprite_url)
+            for product_category in category.products.all()
+        ],
+        'tags': get_category_tags(category.pk),
+    }
@@ -0,0 +1,72 @@
+from rest_framework import serializers
+
+FIELDS_PARAM = 'fields'
+OMIT_PARAM = 'omit'
+
+
+def parse_fieldset(value):
+    """
+    'pk,name,sizes.price' -> {'pk': {}, 'name': {}, 'sizes': {'price': {}}}
+    """
+
+    tree = {}
+    for path in (value or '').split(','):
+        node = tree
+        for name in filter(None, (name.strip() for name in path.split('.'))):
+            node = node.setdefault(name, {})
+    return tree
+
+
+def get_nested(field):
+    if isinstance(field, serializers.ListSerializer):
+        field = field.child
+    if isinstance(field, serializers.BaseSerializer):
+        return field
+    return None
+
+
+def prune_fields(serializer, fields=None, omit=None):
+    """
+    Убирает поля из serializer.fields, поэтому их get_<field>
+    не вызывается, а prefetch план их не учитывает.
+    """
+
+    serializer = get_nested(serializer)
+
+    if fields:
+        for name in list(serializer.fields):
+            if name not in fields:
+                serializer.fields.pop(name)
+            elif fields[name] and get_nested(serializer.fields[name]):
+                prune_fields(serializer.fields[name], fields=fields[name])
+
+    for name, nested in (omit or {}).items():
+        if name not in serializer.fields:
+            continue
+        if not nested:
+            serializer.fields.pop(name)
+        elif get_nested(serializer.fields[name]):
+            prune_fields(serializer.fields[name], omit=nested)
+
+
+def get_fieldset_params(request):
+    return (
+        request.query_params.get(FIELDS_PARAM),
+        request.query_params.get(OMIT_PARAM),
+    )
+
+
+class SparseFieldsetMixin:
+    """
+    Поддержка ?fields=pk,name,sizes.price и ?omit=components.
+    Работает только на верхнем сериализаторе, вложенные режутся им.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        if request is not None:
+            fields, omit = get_fieldset_params(request)
+            if fields or omit:
+                prune_fields(
+                    self, parse_fieldset(fields), parse_fieldset(omit))
@@ -0,0 +1,211 @@
+import django_filters
+from django.db.models import (
+    CharField,
+    Count,
+    Exists,
+    F,
+    Max,
+    Min,
+    OuterRef,
+    Q,
+    Value,
+)
+from django.db.models.functions import Cast, Coalesce
+from django_filters.constants import EMPTY_VALUES
+
+from .configs import MEASUREMENT_UNIT
+from .metrics import NUTRITION_FIELDS
+from .models import Product, ProductProperty, ProductSize
+
+FACETS_PARAM = 'facets'
+
+# Условия на один и тот же размер товара: ?size=1&price_max=500
+# ищет товары, у которых есть размер 1 дешевле 500
+SIZE_LOOKUPS = {
+    'size': 'size_id__in',
+    'measurement': 'size__measurement',
+    'price_min': 'price__gte',
+    'price_max': 'price__lte',
+}
+
+# Фасет -> фильтры, которые не учитываются при подсчете его значений,
+# чтобы можно было выбрать несколько значений одного фасета
+FACET_FILTERS = {
+    'property': ('property',),
+    'size': ('size',),
+    'measurement': ('measurement',),
+    'promotion': ('promotion',),
+}
+
+RANGE_FILTERS = (
+    'price_min',
+    'price_max',
+    *(f'{field}_{bound}'
+      for field in NUTRITION_FIELDS for bound in ('min', 'max')),
+)
+
+
+class CharInFilter(django_filters.BaseInFilter, django_filters.CharFilter):
+    pass
+
+
+class NumberInFilter(django_filters.BaseInFilter, django_filters.NumberFilter):
+    pass
+
+
+def nutrition(field):
+    # То же значение, что отдает get_kpfc
+    return Coalesce(field, f'total_{field}')
+
+
+class ProductFilter(django_filters.FilterSet):
+    """
+    ?property=hot,veg - товары со всеми свойствами
+    ?size=1,2&measurement=шт&price_min=300&price_max=500 - по размерам
+    ?promotion=slug - по акции
+    ?calorie_min=100&fats_max=20 - по КБЖУ
+    """
+
+    property = CharInFilter(method='filter_property')
+    size = NumberInFilter(field_name='sizes__size')
+    measurement = django_filters.ChoiceFilter(
+        field_name='sizes__size__measurement',
+        choices=MEASUREMENT_UNIT,
+    )
+    price_min = django_filters.NumberFilter(
+        field_name='sizes__price', lookup_expr='gte')
+    price_max = django_filters.NumberFilter(
+        field_name='sizes__price', lookup_expr='lte')
+    promotion = CharInFilter(field_name='promotion__slug')
+
+    calorie_min = django_filters.NumberFilter(
+        field_name='kpfc_calorie', lookup_expr='gte')
+    calorie_max = django_filters.NumberFilter(
+        field_name='kpfc_calorie', lookup_expr='lte')
+    proteins_min = django_filters.NumberFilter(
+        field_name='kpfc_proteins', lookup_expr='gte')
+    proteins_max = django_filters.NumberFilter(
+        field_name='kpfc_proteins', lookup_expr='lte')
+    fats_min = django_filters.NumberFilter(
+        field_name='kpfc_fats', lookup_expr='gte')
+    fats_max = django_filters.NumberFilter(
+        field_name='kpfc_fats', lookup_expr='lte')
+    carbohydrates_min = django_filters.NumberFilter(
+        field_name='kpfc_carbohydrates', lookup_expr='gte')
+    carbohydrates_max = django_filters.NumberFilter(
+        field_name='kpfc_carbohydrates', lookup_expr='lte')
+
+    class Meta:
+        model = Product
+        fields = ()
+
+    def filter_property(self, queryset, name, value):
+        # EXISTS на каждое свойство вместо JOIN, чтобы не плодить строки
+        for slug in value:
+            queryset = queryset.filter(Exists(ProductProperty.objects.filter(
+                product=OuterRef('pk'), property__slug=slug)))
+        return queryset
+
+    def filter_queryset(self, queryset):
+        queryset = queryset.alias(**{
+            f'kpfc_{field}': nutrition(field) for field in NUTRITION_FIELDS
+        })
+
+        sizes = Q()
+        for name, value in self.form.cleaned_data.items():
+            if value in EMPTY_VALUES:
+                continue
+            if name in SIZE_LOOKUPS:
+                sizes &= Q(**{SIZE_LOOKUPS[name]: value})
+                continue
+            queryset = self.filters[name].filter(queryset, value)
+
+        if sizes:
+            queryset = queryset.filter(Exists(ProductSize.objects.filter(
+                sizes, product=OuterRef('pk'))))
+        return queryset
+
+
+def is_filtering(query_params):
+    return any(name in query_params for name in ProductFilter.base_filters)
+
+
+def wants_facets(query_params):
+    return query_params.get(FACETS_PARAM) in ('1', 'true')
+
+
+def get_facets(query_params, queryset):
+    """
+    Счетчики фасетов для текущих фильтров. Значения всех фасетов
+    считаются одним UNION ALL запросом, границы цены и КБЖУ -
+    вторым агрегатным запросом.
+    """
+
+    def product_ids(*exclude):
+        params = query_params.copy()
+        for name in exclude:
+            params.pop(name, None)
+        return ProductFilter(params, queryset=queryset).qs.values('pk')
+
+    def facet(rows, name, value, product='product'):
+        return rows.order_by().values(
+            facet=Value(name),
+            value=Cast(value, CharField()),
+        ).annotate(count=Count(product, distinct=True))
+
+    branches = [
+        facet(
+            ProductProperty.objects.filter(
+                product__in=product_ids(*FACET_FILTERS['property'])),
+            'property', F('property__slug'),
+        ),
+        facet(
+            ProductSize.objects.filter(
+                product__in=product_ids(*FACET_FILTERS['size'])),
+            'size', F('size_id'),
+        ),
+        facet(
+            ProductSize.objects.filter(
+                product__in=product_ids(*FACET_FILTERS['measurement'])),
+            'measurement', F('size__measurement'),
+        ),
+        facet(
+            Product.objects.filter(
+                pk__in=product_ids(*FACET_FILTERS['promotion']),
+                promotion__isnull=False,
+            ),
+            'promotion', F('promotion__slug'), product='pk',
+        ),
+        facet(
+            Product.objects.filter(pk__in=product_ids()),
+            'count', Value(''), product='pk',
+        ),
+    ]
+
+    # Если ничего не нашлось, ветка count не вернет ни одной строки
+    facets = {name: {} for name in FACET_FILTERS}
+    facets['count'] = 0
+    rows = branches[0].union(*branches[1:], all=True)
+    for row in rows.order_by('facet', 'value'):
+        if row['facet'] == 'count':
+            facets['count'] = row['count']
+        else:
+            facets[row['facet']][row['value']] = row['count']
+
+    bounds = Product.objects.filter(
+        pk__in=product_ids(*RANGE_FILTERS),
+    ).aggregate(
+        price_min=Min('min_price'),
+        price_max=Max('max_price'),
+        **{
+            f'{field}_{bound}': aggregate(nutrition(field))
+            for field in NUTRITION_FIELDS
+            for bound, aggregate in (('min', Min), ('max', Max))
+        },
+    )
+    for field in ('price', *NUTRITION_FIELDS):
+        facets[field] = {
+            'min': bounds[f'{field}_min'],
+            'max': bounds[f'{field}_max'],
+        }
+    return facets
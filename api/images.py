@@ -0,0 +1,173 @@
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+
+from .imaging import (
+    is_supported,
+    missing_targets,
+    process_image,
+    variant_name,
+)
+from .models import Banner, Category, Product, Promotion, Property
+
+logger = logging.getLogger(__name__)
+
+# Модели с полем image, для которых готовятся варианты
+IMAGE_MODELS = (Product, Category, Banner, Promotion)
+
+# Поля с картинками, для которых хранятся размер и заглушка
+IMAGE_FIELDS = {
+    **{model: 'image' for model in IMAGE_MODELS},
+    Property: 'icon',
+}
+
+# srcset картинок, у которых готовы все варианты. Готовые варианты
+# не меняются, поэтому их наличие больше не проверяется
+ready_srcsets = {}
+
+
+@lru_cache(maxsize=None)
+def get_formats():
+    return tuple(
+        fmt for fmt in settings.IMAGE_VARIANT_FORMATS if is_supported(fmt))
+
+
+def build_srcset(name):
+    """
+    srcset из уже записанных вариантов и признак, что готовы все.
+    """
+
+    srcset = {}
+    complete = True
+    for fmt in get_formats():
+        sources = []
+        for width in settings.IMAGE_VARIANT_WIDTHS:
+            variant = variant_name(name, width, fmt)
+            if os.path.exists(default_storage.path(variant)):
+                sources.append(f'{default_storage.url(variant)} {width}w')
+            else:
+                complete = False
+        if sources:
+            srcset[fmt] = ', '.join(sources)
+    return srcset or None, complete
+
+
+def image_srcset(file):
+    """
+    {'webp': '/media/variants/.../320.webp 320w, ...', 'jpeg': ...}
+    для <source type="image/webp" srcset="...">. Пока варианты
+    готовятся, в srcset только записанные, а без них - None.
+    """
+
+    if not file:
+        return None
+    srcset = ready_srcsets.get(file.name)
+    if srcset is None:
+        srcset, complete = build_srcset(file.name)
+        if complete:
+            ready_srcsets[file.name] = srcset
+    return srcset
+
+
+def get_variant_job(name):
+    targets = [
+        (default_storage.path(variant_name(name, width, fmt)), width, fmt)
+        for width in settings.IMAGE_VARIANT_WIDTHS
+        for fmt in get_formats()
+    ]
+    return default_storage.path(name), targets
+
+
+def info_fields(field):
+    return [f'{field}_width', f'{field}_height', f'{field}_placeholder']
+
+
+def get_image_job(model, name, force=False, describe=False):
+    """
+    Аргументы для imaging.process_image: исходный файл, недостающие
+    варианты и нужно ли описать саму картинку.
+    """
+
+    if model in IMAGE_MODELS:
+        source, targets = get_variant_job(name)
+        if not force:
+            targets = missing_targets(targets)
+    else:
+        source, targets = default_storage.path(name), []
+    return source, targets, describe
+
+
+def save_image_info(model, name, info):
+    """
+    Записывает размер и заглушку во все строки с этим файлом. Через
+    save(), чтобы сигналы обновили updated_at и сбросили кеши каталога.
+    """
+
+    field = IMAGE_FIELDS[model]
+    update_fields = info_fields(field)
+    if any(f.name == 'updated_at' for f in model._meta.fields):
+        update_fields.append('updated_at')
+    for instance in model.objects.filter(**{field: name}):
+        for attname, value in zip(info_fields(field), info):
+            setattr(instance, attname, value)
+        instance.save(update_fields=update_fields)
+
+
+@lru_cache(maxsize=None)
+def get_executor():
+    return ProcessPoolExecutor(max_workers=settings.IMAGE_WORKERS)
+
+
+def image_processed(model, name):
+    # Импорт здесь: snapshots сам зависит от этого модуля через fastpath
+    from .snapshots import invalidate_catalog
+
+    def callback(future):
+        if future.exception() is not None:
+            logger.error('Не удалось обработать картинку %s: %s',
+                         name, future.exception())
+            return
+        result = future.result()
+        if result['info'] is None and not result['written']:
+            return
+        # Колбэк выполняется в служебном потоке пула,
+        # его соединение с базой закрываем сами
+        try:
+            if result['info'] is not None:
+                save_image_info(model, name, result['info'])
+            else:
+                # В снимках каталога srcset без новых вариантов
+                invalidate_catalog()
+        except Exception:
+            logger.exception('Не удалось сохранить размер картинки %s', name)
+        finally:
+            connection.close()
+    return callback
+
+
+def submit_image(model, name, describe):
+    source, targets, describe = get_image_job(model, name, describe=describe)
+    if not os.path.exists(source):
+        logger.warning('Нет файла %s, картинка не обрабатывается', name)
+        return
+    # Уже готовые варианты не пересоздаются, поэтому сохранение
+    # без смены картинки не нагружает пул
+    if targets or describe:
+        future = get_executor().submit(
+            process_image, source, targets, describe)
+        future.add_done_callback(image_processed(model, name))
+
+
+def schedule_image(model, name, describe):
+    """
+    Картинка обрабатывается в пуле процессов после коммита,
+    запрос не ждет ресайза и подсчета заглушки.
+    """
+
+    if name:
+        transaction.on_commit(lambda: submit_image(model, name, describe))
@@ -0,0 +1,173 @@
+"""
+Работа с картинками без Django, чтобы функции можно было
+выполнять в отдельных процессах ProcessPoolExecutor.
+"""
+import base64
+import os
+from io import BytesIO
+from pathlib import PurePosixPath
+from xml.etree import ElementTree
+
+from PIL import Image, ImageOps
+
+VARIANTS_DIR = 'variants'
+
+PLACEHOLDER_SIZE = 16
+PLACEHOLDER_QUALITY = 30
+
+SVG_NS = 'http://www.w3.org/2000/svg'
+XLINK_NS = 'http://www.w3.org/1999/xlink'
+ElementTree.register_namespace('', SVG_NS)
+ElementTree.register_namespace('xlink', XLINK_NS)
+
+# Формат варианта -> формат Pillow и параметры сохранения
+FORMATS = {
+    'avif': ('AVIF', {'quality': 60}),
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', {'quality': 80, 'optimize': True, 'progressive': True}),
+}
+
+
+def is_supported(fmt):
+    Image.init()
+    return FORMATS[fmt][0] in Image.SAVE
+
+
+def variant_name(name, width, fmt):
+    """
+    'products/images/x.jpg' -> 'variants/products/images/x/640.webp'
+    """
+
+    stem = PurePosixPath(name).with_suffix('')
+    return f'{VARIANTS_DIR}/{stem}/{width}.{fmt}'
+
+
+def resize(image, width):
+    if image.width <= width:
+        return image
+    height = max(1, round(image.height * width / image.width))
+    return image.resize((width, height), Image.LANCZOS, reducing_gap=3.0)
+
+
+def save(image, path, fmt):
+    pil_format, params = FORMATS[fmt]
+    if pil_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        image = background
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Пишем во временный файл, чтобы не отдать недописанную картинку.
+    # Имя с pid: тот же вариант может писать и пул, и process_media
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    image.save(tmp_path, pil_format, **params)
+    os.replace(tmp_path, path)
+
+
+def missing_targets(targets):
+    return [target for target in targets if not os.path.exists(target[0])]
+
+
+def svg_size(source):
+    """
+    Размер SVG из width/height, а если их нет - из viewBox.
+    """
+
+    root = ElementTree.parse(source).getroot()
+    width = root.get('width', '').removesuffix('px')
+    height = root.get('height', '').removesuffix('px')
+    if not (width and height) and root.get('viewBox'):
+        width, height = root.get('viewBox').replace(',', ' ').split()[2:4]
+    try:
+        return round(float(width)), round(float(height))
+    except ValueError:
+        return None, None
+
+
+def make_placeholder(image):
+    """
+    Картинка шириной PLACEHOLDER_SIZE в data URI, которую клиент
+    растягивает с размытием, пока грузится настоящая.
+    """
+
+    thumbnail = image.copy()
+    thumbnail.thumbnail((PLACEHOLDER_SIZE, PLACEHOLDER_SIZE))
+    fmt = 'webp' if is_supported('webp') else 'jpeg'
+    if fmt == 'jpeg' and thumbnail.mode not in ('RGB', 'L'):
+        thumbnail = thumbnail.convert('RGB')
+    buffer = BytesIO()
+    thumbnail.save(buffer, FORMATS[fmt][0], quality=PLACEHOLDER_QUALITY)
+    encoded = base64.b64encode(buffer.getvalue()).decode()
+    return f'data:image/{fmt};base64,{encoded}'
+
+
+def process_image(source, targets, describe=False):
+    """
+    Готовит варианты targets - [(путь, ширина, формат)] - и, если
+    describe, размер и заглушку картинки. Картинка не увеличивается:
+    вариант шире оригинала сохраняется в размере оригинала.
+    Возвращает количество записанных файлов и (ширина, высота, заглушка).
+    """
+
+    if source.lower().endswith('.svg'):
+        return {'written': 0, 'info': (*svg_size(source), None)}
+
+    with Image.open(source) as image:
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ('RGB', 'RGBA', 'L', 'LA'):
+            image = image.convert('RGBA')
+        resized = {}
+        for path, width, fmt in targets:
+            if width not in resized:
+                resized[width] = resize(image, width)
+            save(resized[width], path, fmt)
+
+        info = None
+        if describe:
+            info = (image.width, image.height, make_placeholder(image))
+    return {'written': len(targets), 'info': info}
+
+
+def svg_symbol(symbol_id, source):
+    root = ElementTree.parse(source).getroot()
+    view_box = root.get('viewBox')
+    if view_box is None:
+        view_box = '0 0 {} {}'.format(*svg_size(source))
+    symbol = ElementTree.Element(
+        f'{{{SVG_NS}}}symbol', id=symbol_id, viewBox=view_box)
+    symbol.extend(root)
+    return symbol
+
+
+def raster_symbol(symbol_id, source):
+    with Image.open(source) as image:
+        width, height = image.size
+        mime_type = Image.MIME.get(image.format, 'image/png')
+    with open(source, 'rb') as file:
+        encoded = base64.b64encode(file.read()).decode()
+    symbol = ElementTree.Element(
+        f'{{{SVG_NS}}}symbol', id=symbol_id, viewBox=f'0 0 {width} {height}')
+    ElementTree.SubElement(symbol, f'{{{SVG_NS}}}image', {
+        'width': str(width),
+        'height': str(height),
+        'href': f'data:{mime_type};base64,{encoded}',
+    })
+    return symbol
+
+
+def build_sprite(icons):
+    """
+    SVG со всеми иконками icons - [(id, путь)] - в виде <symbol>.
+    Клиент рисует иконку через <use href="sprite.svg#id">.
+    Растровые иконки встраиваются в символ как data URI.
+    """
+
+    sprite = ElementTree.Element(
+        f'{{{SVG_NS}}}svg', style='display: none')
+    for symbol_id, source in icons:
+        if source.lower().endswith('.svg'):
+            sprite.append(svg_symbol(symbol_id, source))
+        else:
+            sprite.append(raster_symbol(symbol_id, source))
+    return ElementTree.tostring(sprite, encoding='utf-8')
@@ -0,0 +1,160 @@
+from datetime import timedelta
+from smtplib import SMTPResponseException, SMTPServerDisconnected
+
+from django.core.mail import EmailMultiAlternatives
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import OutgoingEmail
+
+MAX_ATTEMPTS = 8
+BACKOFF_BASE = timedelta(seconds=30)
+BACKOFF_MAX = timedelta(hours=1)
+# Сколько воркер держит взятые письма. Если он упал, письма
+# после этого срока заберет другой
+LOCK_TIMEOUT = timedelta(minutes=5)
+
+
+def enqueue_email(to, subject, html_body='', body='', expires_at=None):
+    """
+    Кладет письмо в очередь. Вызывается в транзакции запроса: письмо
+    уйдет, только если запрос закоммитился, а отправляет его
+    run_mail_worker, так что запрос не ждет почтовый сервер.
+    Не отправленное до expires_at письмо больше не отправляется.
+    """
+
+    return OutgoingEmail.objects.create(
+        to=to,
+        subject=subject,
+        html_body=html_body,
+        body=body,
+        expires_at=expires_at,
+    )
+
+
+def get_backoff(attempts):
+    return min(BACKOFF_BASE * 2 ** (attempts - 1), BACKOFF_MAX)
+
+
+def unclaimed(now):
+    return Q(locked_until__isnull=True) | Q(locked_until__lte=now)
+
+
+def pending_emails(now):
+    return OutgoingEmail.objects.filter(
+        unclaimed(now),
+        Q(expires_at__isnull=True) | Q(expires_at__gt=now),
+        sent_at__isnull=True,
+        failed_at__isnull=True,
+        attempts__lt=MAX_ATTEMPTS,
+        send_after__lte=now,
+    ).order_by('send_after', 'pk')
+
+
+def fail_expired(now):
+    """
+    Отмечает failed_at письма, срок которых истек в очереди, чтобы
+    они вышли из частичного индекса outgoingemail_queue_idx.
+    Письма, которые сейчас отправляет воркер, не трогаются.
+    """
+
+    return OutgoingEmail.objects.filter(
+        unclaimed(now),
+        sent_at__isnull=True,
+        failed_at__isnull=True,
+        expires_at__lte=now,
+    ).update(failed_at=now)
+
+
+def build_message(email, connection):
+    message = EmailMultiAlternatives(
+        subject=email.subject,
+        body=email.body,
+        to=[email.to],
+        connection=connection,
+    )
+    if email.html_body:
+        message.attach_alternative(email.html_body, 'text/html')
+    return message
+
+
+def send_message(message, connection):
+    """
+    Отправляет письмо через постоянное соединение. Сервер закрывает
+    соединение, которое долго простаивало, поэтому при обрыве
+    переподключаемся один раз.
+    """
+
+    try:
+        # Если соединение уже открыто, open() ничего не делает
+        connection.open()
+        message.send()
+    except SMTPServerDisconnected:
+        connection.close()
+        connection.open()
+        message.send()
+
+
+def claim_batch(batch_size):
+    """
+    Забирает пачку писем в короткой транзакции: строки помечаются
+    locked_until, и до этого срока другие воркеры их пропускают.
+    Возвращает письма и срок, до которого их можно отправлять.
+    """
+
+    now = timezone.now()
+    locked_until = now + LOCK_TIMEOUT
+    fail_expired(now)
+    with transaction.atomic():
+        emails = list(pending_emails(now).select_for_update(
+            skip_locked=True)[:batch_size])
+        OutgoingEmail.objects.filter(
+            pk__in=[email.pk for email in emails],
+        ).update(locked_until=locked_until)
+    return emails, locked_until
+
+
+def send_batch(connection, batch_size):
+    """
+    Отправляет пачку писем через общее соединение connection. Письма
+    отправляются вне транзакции, и каждое отмечается сразу после
+    отправки, поэтому воркеров может быть несколько. Неудачная
+    отправка откладывается с растущей паузой.
+    Возвращает (отправлено, ошибок).
+    """
+
+    sent = 0
+    failed = 0
+    emails, locked_until = claim_batch(batch_size)
+    for email in emails:
+        if timezone.now() >= locked_until:
+            # Остальные письма уже может забрать другой воркер
+            break
+        queued = OutgoingEmail.objects.filter(pk=email.pk)
+        try:
+            send_message(build_message(email, connection), connection)
+        except Exception as error:
+            attempts = email.attempts + 1
+            now = timezone.now()
+            queued.update(
+                attempts=attempts,
+                send_after=now + get_backoff(attempts),
+                last_error=repr(error),
+                locked_until=None,
+                # Попытки кончились, письмо уходит из очереди
+                failed_at=now if attempts >= MAX_ATTEMPTS else None,
+            )
+            failed += 1
+            # После ответа сервера с ошибкой соединение рабочее,
+            # иначе следующее письмо пойдет через новое
+            if not isinstance(error, SMTPResponseException):
+                connection.close()
+        else:
+            queued.update(
+                attempts=F('attempts') + 1,
+                sent_at=timezone.now(),
+                locked_until=None,
+            )
+            sent += 1
+    return sent, failed
@@ -0,0 +1,44 @@
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from api.images import IMAGE_MODELS
+from api.models import Category, Product, Property
+from api.snapshots import invalidate_catalog
+from api.storage import is_hashed
+
+FILE_FIELDS = (
+    *((model, 'image') for model in IMAGE_MODELS),
+    (Property, 'icon'),
+)
+
+
+class Command(BaseCommand):
+    help = ('Переносит загруженные раньше файлы под имена из хеша '
+            'содержимого и готовит для них варианты картинок')
+
+    def handle(self, *args, **options):
+        renamed = 0
+        for model, field in FILE_FIELDS:
+            rows = model.objects.exclude(**{field: ''}).values_list(
+                'pk', field)
+            for pk, name in rows:
+                if is_hashed(name) or not default_storage.exists(name):
+                    continue
+                with default_storage.open(name) as file:
+                    new_name = default_storage.save(name, file)
+                # update() без сигналов: кеши сбрасываются один раз ниже
+                model.objects.filter(pk=pk).update(**{field: new_name})
+                renamed += 1
+
+        if renamed:
+            # Ссылки поменялись во всем каталоге, поэтому сбрасываем
+            # и снимки категорий, и ETag списков
+            now = timezone.now()
+            Product.objects.update(updated_at=now)
+            Category.objects.update(updated_at=now)
+            invalidate_catalog()
+        self.stdout.write(self.style.SUCCESS(
+            f'Перенесено файлов: {renamed}'))
+        call_command('process_media', stdout=self.stdout, stderr=self.stderr)
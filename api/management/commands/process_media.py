@@ -0,0 +1,69 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.core.management.base import BaseCommand
+
+from api.images import IMAGE_FIELDS, get_image_job, save_image_info
+from api.imaging import process_image
+
+
+class Command(BaseCommand):
+    help = ('Готовит варианты картинок для srcset и заполняет размер '
+            'и заглушку по уже загруженным файлам')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count())
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Пересоздать уже готовые варианты и заглушки',
+        )
+
+    def handle(self, *args, **options):
+        jobs = {}
+        seen = set()
+        for model, field in IMAGE_FIELDS.items():
+            rows = model.objects.exclude(**{field: ''}).exclude(
+                **{f'{field}__isnull': True}).values_list(
+                field, f'{field}_width').distinct()
+            for name, width in sorted(rows, key=lambda row: row[0]):
+                describe = options['force'] or width is None
+                if (model, name) in jobs:
+                    # Одна картинка в нескольких строках, и хотя бы
+                    # в одной из них нет размера
+                    if describe:
+                        jobs[model, name] = (*jobs[model, name][:2], True)
+                    continue
+                source, targets, describe = get_image_job(
+                    model, name, options['force'], describe)
+                # Варианты одного файла из разных моделей готовим один раз
+                if name in seen:
+                    targets = []
+                seen.add(name)
+                if targets or describe:
+                    jobs[model, name] = (source, targets, describe)
+
+        written = 0
+        described = 0
+        failed = 0
+        with ProcessPoolExecutor(max_workers=options['workers']) as pool:
+            futures = {
+                pool.submit(process_image, *job): key
+                for key, job in jobs.items()
+            }
+            for future in as_completed(futures):
+                model, name = futures[future]
+                try:
+                    result = future.result()
+                except Exception as error:
+                    failed += 1
+                    self.stderr.write(f'{name}: {error}')
+                    continue
+                written += result['written']
+                if result['info'] is not None:
+                    save_image_info(model, name, result['info'])
+                    described += 1
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Картинок: {len(jobs)}, записано вариантов: {written}, '
+            f'описано картинок: {described}, ошибок: {failed}'))
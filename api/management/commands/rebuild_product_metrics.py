@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from api.metrics import refresh_product_metrics
+from api.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает вес, количество, цены и КБЖУ всех товаров'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        product_ids = list(
+            Product.objects.order_by('pk').values_list('pk', flat=True))
+
+        updated = 0
+        for start in range(0, len(product_ids), batch_size):
+            updated += refresh_product_metrics(
+                product_ids[start:start + batch_size], with_parents=False)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Пересчитано товаров: {updated}'))
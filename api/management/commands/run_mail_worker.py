@@ -0,0 +1,51 @@
+import time
+
+from django.core.mail import get_connection
+from django.core.management.base import BaseCommand
+
+from api.mail import send_batch
+
+
+class Command(BaseCommand):
+    help = ('Отправляет письма из очереди OutgoingEmail через одно '
+            'постоянное SMTP соединение')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=50)
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=2,
+            help='Пауза в секундах, когда очередь пуста',
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Отправить то, что есть в очереди, и завершиться',
+        )
+
+    def handle(self, *args, **options):
+        # Соединение открывается при первой отправке и живет,
+        # пока работает воркер
+        connection = get_connection()
+        total_sent = 0
+        total_failed = 0
+        try:
+            while True:
+                sent, failed = send_batch(connection, options['batch_size'])
+                total_sent += sent
+                total_failed += failed
+                if sent or failed:
+                    self.stdout.write(
+                        f'Отправлено: {sent}, ошибок: {failed}')
+                    continue
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+        finally:
+            connection.close()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Всего отправлено: {total_sent}, ошибок: {total_failed}'))
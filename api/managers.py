@@ -0,0 +1,97 @@
+from collections import defaultdict
+
+from django.db import connections, models
+
+EXPAND_SQL = '''
+WITH RECURSIVE tree (root_id, product_id, is_full, path) AS (
+    SELECT parent_product_id, child_product_id, is_full,
+           ARRAY[parent_product_id, child_product_id]
+    FROM {table}
+    WHERE parent_product_id = ANY(%s)
+  UNION ALL
+    SELECT tree.root_id, item.child_product_id,
+           tree.is_full AND item.is_full,
+           tree.path || item.child_product_id
+    FROM tree
+    JOIN {table} AS item ON item.parent_product_id = tree.product_id
+    WHERE item.child_product_id <> ALL(tree.path)
+)
+SELECT root_id, product_id, is_full, COUNT(*)
+FROM tree
+WHERE NOT EXISTS (
+    SELECT 1 FROM {table} AS item
+    WHERE item.parent_product_id = tree.product_id
+)
+GROUP BY root_id, product_id, is_full
+ORDER BY root_id, product_id, is_full
+'''
+
+ANCESTORS_SQL = '''
+WITH RECURSIVE ancestors (product_id) AS (
+    SELECT parent_product_id FROM {table}
+    WHERE child_product_id = ANY(%s)
+  UNION
+    SELECT item.parent_product_id
+    FROM ancestors
+    JOIN {table} AS item ON item.child_product_id = ancestors.product_id
+)
+SELECT product_id FROM ancestors
+'''
+
+
+class CollectionManager(models.Manager):
+    """
+    Обход вложенных наборов одним рекурсивным запросом
+    вместо запроса на каждый уровень.
+    """
+
+    def fetch(self, sql, product_ids):
+        with connections[self.db].cursor() as cursor:
+            cursor.execute(
+                sql.format(table=self.model._meta.db_table),
+                [list(product_ids)],
+            )
+            return cursor.fetchall()
+
+    def expand(self, product_ids):
+        """
+        Раскрывает наборы до товаров без состава.
+        {id набора: [(id товара, is_full, сколько раз входит)]}.
+        Товар целый, только если целые все звенья пути до него.
+        """
+
+        leaves = defaultdict(list)
+        for root_id, product_id, is_full, count in self.fetch(
+                EXPAND_SQL, product_ids):
+            leaves[root_id].append((product_id, is_full, count))
+        return leaves
+
+    def ancestor_ids(self, product_ids):
+        """
+        Все наборы, в которые товары входят на любой глубине.
+        """
+
+        return {
+            product_id
+            for product_id, in self.fetch(ANCESTORS_SQL, product_ids)
+        }
+
+    def lock(self):
+        """
+        Блокирует запись в таблицу до конца транзакции, чтение идет
+        как обычно. Проверки на цикл идут по очереди: блокировки
+        только строк товаров мало, наборы A -> B и C -> D, а потом
+        B -> C и D -> A попарно не пересекаются и замкнули бы кольцо.
+        """
+
+        with connections[self.db].cursor() as cursor:
+            cursor.execute(
+                f'LOCK TABLE {self.model._meta.db_table} '
+                'IN SHARE ROW EXCLUSIVE MODE'
+            )
+
+    def creates_cycle(self, parent_id, child_id):
+        return (
+            parent_id == child_id
+            or child_id in self.ancestor_ids([parent_id])
+        )
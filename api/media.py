@@ -0,0 +1,44 @@
+import posixpath
+from urllib.parse import quote
+
+from django.conf import settings
+from django.http import Http404, HttpResponse
+from django.utils.cache import patch_cache_control
+from django.views.static import serve
+
+from .storage import is_hashed
+
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+MUTABLE_MAX_AGE = 60 * 60
+
+
+def serve_media(request, path):
+    """
+    Отдает медиа с кешированием: файлы с хешем в имени навсегда,
+    старые файлы с исходными именами на час. Если задан
+    MEDIA_ACCEL_REDIRECT, сам файл отдает nginx через X-Accel-Redirect.
+    Без него файлы с диска читаются только при DEBUG, как в
+    django.conf.urls.static: в рабочем режиме медиа отдает nginx.
+    """
+
+    path = posixpath.normpath(path).lstrip('/')
+    if path.startswith('..'):
+        raise Http404
+
+    if settings.MEDIA_ACCEL_REDIRECT:
+        response = HttpResponse()
+        response['X-Accel-Redirect'] = (
+            settings.MEDIA_ACCEL_REDIRECT + quote(path))
+        # Тип файла nginx определит сам
+        del response['Content-Type']
+    elif settings.DEBUG:
+        response = serve(request, path, document_root=settings.MEDIA_ROOT)
+    else:
+        raise Http404
+
+    if is_hashed(path):
+        patch_cache_control(
+            response, public=True, max_age=IMMUTABLE_MAX_AGE, immutable=True)
+    else:
+        patch_cache_control(response, public=True, max_age=MUTABLE_MAX_AGE)
+    return response
@@ -0,0 +1,132 @@
+from collections import defaultdict
+
+from django.db import transaction
+
+from .models import Product, ProductSize, Collection
+
+NUTRITION_FIELDS = ('calorie', 'proteins', 'fats', 'carbohydrates')
+
+METRIC_FIELDS = (
+    'total_weight',
+    'amount',
+    'min_price',
+    'max_price',
+    *(f'total_{field}' for field in NUTRITION_FIELDS),
+)
+
+
+def get_parent_ids(product_ids):
+    # Наборы на любой глубине: метрики вложенного набора
+    # входят в метрики всех наборов выше
+    return Collection.objects.ancestor_ids(product_ids)
+
+
+def compute_total_weight(components, sizes):
+    total_weight = 0
+
+    for child_id, is_full in components:
+        weights = [size['weight'] for size in sizes[child_id]]
+        if not weights:
+            continue
+        total_weight += max(weights) if is_full else min(weights)
+
+    return total_weight or None
+
+
+def compute_amount(components, sizes):
+    if not components:
+        return None
+
+    amount = 0
+
+    for child_id, is_full in components:
+        child_sizes = sizes[child_id]
+        if not child_sizes or child_sizes[-1]['measurement'] == 'см':
+            return None
+        sorted_sizes = sorted(size['size'] for size in child_sizes)
+        amount += sorted_sizes[-1] if is_full else sorted_sizes[0]
+
+    return amount
+
+
+def compute_nutrition(components, nutrition):
+    result = {f'total_{field}': None for field in NUTRITION_FIELDS}
+
+    for child_id, _ in components:
+        for field, value in nutrition.get(child_id, {}).items():
+            if value is None:
+                continue
+            key = f'total_{field}'
+            result[key] = (result[key] or 0) + value
+
+    return result
+
+
+def compute_metrics(product_ids):
+    """
+    Считает метрики товаров за несколько запросов,
+    не загружая сами товары и их сериализаторы.
+    """
+
+    # Наборы раскрываются до товаров без состава, товар входит
+    # в список столько раз, сколько раз он лежит в наборе
+    components = defaultdict(list)
+    for parent_id, leaves in Collection.objects.expand(product_ids).items():
+        for child_id, is_full, count in leaves:
+            components[parent_id].extend([(child_id, is_full)] * count)
+
+    child_ids = {
+        child_id for items in components.values() for child_id, _ in items
+    }
+
+    sizes = defaultdict(list)
+    for size in ProductSize.objects.filter(
+        product_id__in={*product_ids, *child_ids},
+    ).order_by('pk').values(
+        'product_id', 'price', 'weight', 'size__size', 'size__measurement',
+    ):
+        sizes[size['product_id']].append({
+            'price': size['price'],
+            'weight': size['weight'],
+            'size': size['size__size'],
+            'measurement': size['size__measurement'],
+        })
+
+    nutrition = {
+        values.pop('pk'): values
+        for values in Product.objects.filter(
+            pk__in=child_ids,
+        ).values('pk', *NUTRITION_FIELDS)
+    }
+
+    metrics = {}
+    for product_id in product_ids:
+        prices = [size['price'] for size in sizes[product_id]]
+        metrics[product_id] = {
+            'total_weight': compute_total_weight(
+                components[product_id], sizes),
+            'amount': compute_amount(components[product_id], sizes),
+            'min_price': min(prices, default=None),
+            'max_price': max(prices, default=None),
+            **compute_nutrition(components[product_id], nutrition),
+        }
+    return metrics
+
+
+def refresh_product_metrics(product_ids, with_parents=True):
+    product_ids = set(product_ids)
+    if with_parents:
+        product_ids |= get_parent_ids(product_ids)
+    if not product_ids:
+        return 0
+
+    products = [
+        Product(pk=product_id, **values)
+        for product_id, values in compute_metrics(product_ids).items()
+    ]
+    return Product.objects.bulk_update(products, METRIC_FIELDS)
+
+
+def schedule_metrics_refresh(product_ids):
+    product_ids = set(product_ids)
+    transaction.on_commit(lambda: refresh_product_metrics(product_ids))
@@ -0,0 +1,53 @@
+# Generated by Django 4.2.2 on 2026-10-18 16:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_property_slug'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='amount',
+            field=models.IntegerField(blank=True, editable=False, null=True, verbose_name='Количество штук'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='max_price',
+            field=models.IntegerField(blank=True, editable=False, null=True, verbose_name='Максимальная цена'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='min_price',
+            field=models.IntegerField(blank=True, editable=False, null=True, verbose_name='Минимальная цена'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='total_calorie',
+            field=models.IntegerField(blank=True, editable=False, null=True, verbose_name='Калории набора'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='total_carbohydrates',
+            field=models.IntegerField(blank=True, editable=False, null=True, verbose_name='Углероды набора'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='total_fats',
+            field=models.IntegerField(blank=True, editable=False, null=True, verbose_name='Жиры набора'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='total_proteins',
+            field=models.IntegerField(blank=True, editable=False, null=True, verbose_name='Белки набора'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='total_weight',
+            field=models.IntegerField(blank=True, editable=False, null=True, verbose_name='Общий вес'),
+        ),
+    ]
@@ -0,0 +1,88 @@
+# Generated by Django 4.2.2 on 2026-10-18 17:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_product_search_vector'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='banner',
+            name='image_height',
+            field=models.IntegerField(blank=True, editable=False, null=True, verbose_name='Высота картинки'),
+        ),
+        migrations.AddField(
+            model_name='banner',
+            name='image_placeholder',
+            field=models.TextField(blank=True, editable=False, null=True, verbose_name='Заглушка картинки'),
+        ),
+        migrations.AddField(
+            model_name='banner',
+            name='image_width',
+            field=models.IntegerField(blank=True, editable=False, null=True, verbose_name='Ширина картинки'),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='image_height',
+            field=models.IntegerField(blank=True, editable=False, null=True, verbose_name='Высота картинки'),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='image_placeholder',
+            field=models.TextField(blank=True, editable=False, null=True, verbose_name='Заглушка картинки'),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='image_width',
+            field=models.IntegerField(blank=True, editable=False, null=True, verbose_name='Ширина картинки'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='image_height',
+            field=models.IntegerField(blank=True, editable=False, null=True, verbose_name='Высота картинки'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='image_placeholder',
+            field=models.TextField(blank=True, editable=False, null=True, verbose_name='Заглушка картинки'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='image_width',
+            field=models.IntegerField(blank=True, editable=False, null=True, verbose_name='Ширина картинки'),
+        ),
+        migrations.AddField(
+            model_name='promotion',
+            name='image_height',
+            field=models.IntegerField(blank=True, editable=False, null=True, verbose_name='Высота картинки'),
+        ),
+        migrations.AddField(
+            model_name='promotion',
+            name='image_placeholder',
+            field=models.TextField(blank=True, editable=False, null=True, verbose_name='Заглушка картинки'),
+        ),
+        migrations.AddField(
+            model_name='promotion',
+            name='image_width',
+            field=models.IntegerField(blank=True, editable=False, null=True, verbose_name='Ширина картинки'),
+        ),
+        migrations.AddField(
+            model_name='property',
+            name='icon_height',
+            field=models.IntegerField(blank=True, editable=False, null=True, verbose_name='Высота иконки'),
+        ),
+        migrations.AddField(
+            model_name='property',
+            name='icon_placeholder',
+            field=models.TextField(blank=True, editable=False, null=True, verbose_name='Заглушка иконки'),
+        ),
+        migrations.AddField(
+            model_name='property',
+            name='icon_width',
+            field=models.IntegerField(blank=True, editable=False, null=True, verbose_name='Ширина иконки'),
+        ),
+    ]
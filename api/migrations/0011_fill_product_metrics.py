@@ -0,0 +1,119 @@
+from collections import defaultdict
+
+from django.db import migrations
+
+# Копия правил api.metrics на момент миграции: миграция работает
+# с историческими моделями и не зависит от того, как код изменится
+NUTRITION_FIELDS = ('calorie', 'proteins', 'fats', 'carbohydrates')
+
+METRIC_FIELDS = (
+    'total_weight',
+    'amount',
+    'min_price',
+    'max_price',
+    *(f'total_{field}' for field in NUTRITION_FIELDS),
+)
+
+
+def expand(components, product_id):
+    """
+    Товары без состава внутри набора: [(id товара, is_full)],
+    товар повторяется столько раз, сколько раз входит в набор.
+    """
+
+    leaves = []
+    stack = [
+        (child_id, is_full, (product_id, child_id))
+        for child_id, is_full in components.get(product_id, ())
+    ]
+    while stack:
+        child_id, is_full, path = stack.pop()
+        if child_id not in components:
+            leaves.append((child_id, is_full))
+            continue
+        for item_id, item_is_full in components[child_id]:
+            if item_id not in path:
+                stack.append(
+                    (item_id, is_full and item_is_full, (*path, item_id)))
+    return leaves
+
+
+def compute_metrics(leaves, sizes, nutrition, prices):
+    total_weight = 0
+    amount = 0 if leaves else None
+    totals = {f'total_{field}': None for field in NUTRITION_FIELDS}
+
+    for child_id, is_full in leaves:
+        child_sizes = sizes[child_id]
+        weights = [size['weight'] for size in child_sizes]
+        if weights:
+            total_weight += max(weights) if is_full else min(weights)
+
+        if amount is not None:
+            if not child_sizes or child_sizes[-1]['measurement'] == 'см':
+                amount = None
+            else:
+                values = sorted(size['size'] for size in child_sizes)
+                amount += values[-1] if is_full else values[0]
+
+        for field, value in nutrition.get(child_id, {}).items():
+            if value is not None:
+                key = f'total_{field}'
+                totals[key] = (totals[key] or 0) + value
+
+    return {
+        'total_weight': total_weight or None,
+        'amount': amount,
+        'min_price': min(prices, default=None),
+        'max_price': max(prices, default=None),
+        **totals,
+    }
+
+
+def fill_product_metrics(apps, schema_editor):
+    Product = apps.get_model('api', 'Product')
+    ProductSize = apps.get_model('api', 'ProductSize')
+    Collection = apps.get_model('api', 'Collection')
+
+    components = defaultdict(list)
+    for parent_id, child_id, is_full in Collection.objects.values_list(
+            'parent_product_id', 'child_product_id', 'is_full'):
+        components[parent_id].append((child_id, is_full))
+    components = dict(components)
+
+    sizes = defaultdict(list)
+    for size in ProductSize.objects.order_by('pk').values(
+        'product_id', 'price', 'weight', 'size__size', 'size__measurement',
+    ):
+        sizes[size['product_id']].append({
+            'price': size['price'],
+            'weight': size['weight'],
+            'size': size['size__size'],
+            'measurement': size['size__measurement'],
+        })
+
+    nutrition = {
+        values.pop('pk'): values
+        for values in Product.objects.values('pk', *NUTRITION_FIELDS)
+    }
+
+    products = []
+    for product_id in nutrition:
+        leaves = expand(components, product_id)
+        prices = [size['price'] for size in sizes[product_id]]
+        products.append(Product(
+            pk=product_id,
+            **compute_metrics(leaves, sizes, nutrition, prices),
+        ))
+    Product.objects.bulk_update(products, METRIC_FIELDS, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_outgoingemail'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_product_metrics, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.2 on 2026-10-18 17:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_fill_product_metrics'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='outgoingemail',
+            name='locked_until',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Занято воркером до'),
+        ),
+    ]
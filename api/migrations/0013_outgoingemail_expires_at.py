@@ -0,0 +1,18 @@
+# Generated by Django 4.2.2 on 2026-10-18 17:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_outgoingemail_locked_until'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='outgoingemail',
+            name='expires_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Не отправлять после'),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 4.2.2 on 2026-10-18 18:15
+
+from django.db import migrations, models
+from django.db.models import Q
+from django.db.models.functions import Now
+
+# Копия api.mail.MAX_ATTEMPTS на момент миграции
+MAX_ATTEMPTS = 8
+
+
+def fail_dead_emails(apps, schema_editor):
+    # Письма, которые уже не отправятся, выходят из индекса очереди
+    OutgoingEmail = apps.get_model('api', 'OutgoingEmail')
+    OutgoingEmail.objects.filter(
+        Q(attempts__gte=MAX_ATTEMPTS) | Q(expires_at__lte=Now()),
+        sent_at__isnull=True,
+    ).update(failed_at=Now())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_outgoingemail_expires_at'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='outgoingemail',
+            name='outgoingemail_queue_idx',
+        ),
+        migrations.AddField(
+            model_name='outgoingemail',
+            name='failed_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Дата отказа'),
+        ),
+        migrations.RunPython(fail_dead_emails, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='outgoingemail',
+            index=models.Index(condition=models.Q(('failed_at__isnull', True), ('sent_at__isnull', True)), fields=['send_after', 'id'], name='outgoingemail_queue_idx'),
+        ),
+    ]
@@ -0,0 +1,143 @@
+from hashlib import md5
+
+from django.conf import settings
+from django.http import Http404
+from rest_framework.response import Response
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+
+from .fieldsets import get_fieldset_params
+from .filters import get_facets, is_filtering, wants_facets
+from .prefetch import plan_for, guard_method_fields
+from .renderers import Fragment
+from .snapshots import (
+    get_catalog_modified,
+    get_catalog_version,
+    get_category_snapshot,
+)
+
+
+class PrefetchPlanMixin:
+    """
+    Строит select_related/prefetch_related по дереву сериализатора,
+    чтобы количество запросов не зависело от количества строк.
+    """
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        plan = plan_for(
+            self.get_serializer_class(),
+            *get_fieldset_params(self.request),
+        )
+        return plan.apply(queryset, self.get_prefetch_filters())
+
+    def get_prefetch_filters(self):
+        return None
+
+    def get_serializer(self, *args, **kwargs):
+        serializer = super().get_serializer(*args, **kwargs)
+        if settings.PREFETCH_GUARD:
+            guard_method_fields(serializer)
+        return serializer
+
+
+def conditional_response(request, etag, last_modified, handler):
+    """
+    304 при совпадении If-None-Match/If-Modified-Since, иначе ответ
+    handler(). В ответ ставятся ETag, Last-Modified и no-cache.
+    """
+
+    response = get_conditional_response(
+        request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = handler()
+
+    if response.status_code in (200, 304):
+        response['ETag'] = etag
+        if last_modified:
+            response['Last-Modified'] = http_date(last_modified)
+        patch_cache_control(response, no_cache=True)
+    return response
+
+
+class ConditionalGetMixin:
+    """
+    ETag и Last-Modified по версии каталога. Версия меняется при
+    любом сохранении и удалении данных каталога и при записи
+    вариантов картинок, поэтому If-None-Match/If-Modified-Since
+    проверяются до сериализации и без запросов в базу, при
+    совпадении отдается 304.
+    """
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional(super().retrieve, request, *args, **kwargs)
+
+    def get_validators(self, request):
+        token = ':'.join((
+            request.get_full_path(),
+            request.accepted_renderer.format,
+            str(get_catalog_version()),
+        ))
+        etag = quote_etag(md5(token.encode()).hexdigest())
+        return etag, get_catalog_modified()
+
+    def conditional(self, handler, request, *args, **kwargs):
+        etag, last_modified = self.get_validators(request)
+        return conditional_response(
+            request, etag, last_modified,
+            lambda: handler(request, *args, **kwargs),
+        )
+
+
+class FacetMixin:
+    """
+    Добавляет в ответ счетчики фасетов при ?facets=1.
+    facet_actions - действия, для которых они считаются.
+    """
+
+    facet_actions = ('list',)
+
+    def get_facet_queryset(self):
+        raise NotImplementedError
+
+    def add_facets(self, response):
+        if (self.action in self.facet_actions
+                and response.status_code == 200
+                and wants_facets(self.request.query_params)):
+            response.data['facets'] = get_facets(
+                self.request.query_params, self.get_facet_queryset())
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.add_facets(super().list(request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.add_facets(super().retrieve(request, *args, **kwargs))
+
+
+class CategorySnapshotMixin:
+    """
+    Отдает категорию из готового снимка, если клиент не просит
+    урезанный набор полей, фильтры или фасеты. ETag снимка - хеш его
+    байтов, поэтому ответ проверяется без запросов в базу и меняется
+    при любой пересборке снимка. Стоит в классе раньше
+    ConditionalGetMixin, который проверяет остальные ответы.
+    """
+
+    def retrieve(self, request, *args, **kwargs):
+        params = request.query_params
+        if (any(get_fieldset_params(request))
+                or is_filtering(params) or wants_facets(params)):
+            return super().retrieve(request, *args, **kwargs)
+
+        snapshot = get_category_snapshot(kwargs[self.lookup_field])
+        if snapshot is None:
+            raise Http404
+        content, digest, built_at = snapshot
+        token = f'{request.accepted_renderer.format}:{digest}'
+        etag = quote_etag(md5(token.encode()).hexdigest())
+        return conditional_response(
+            request, etag, built_at, lambda: Response(Fragment(content)))
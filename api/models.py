@@ -1,8 +1,13 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth import get_user_model
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
+from django.core.exceptions import ValidationError
 from django.db.models import UniqueConstraint
+from django.utils import timezone
 
 from .configs import MEASUREMENT_UNIT
+from .managers import CollectionManager
 from .validators import (
     positive_number,
     validate_less_hundred,
@@ -47,6 +52,24 @@ class Property(models.Model):
         blank=True,
         null=True,
     )
+    icon_width = models.IntegerField(
+        'Ширина иконки',
+        null=True,
+        blank=True,
+        editable=False,
+    )
+    icon_height = models.IntegerField(
+        'Высота иконки',
+        null=True,
+        blank=True,
+        editable=False,
+    )
+    icon_placeholder = models.TextField(
+        'Заглушка иконки',
+        null=True,
+        blank=True,
+        editable=False,
+    )
 
     def __str__(self):
         return self.name
@@ -135,6 +158,24 @@ class Promotion(models.Model):
         'Картинка',
         upload_to='promotions/images/',
     )
+    image_width = models.IntegerField(
+        'Ширина картинки',
+        null=True,
+        blank=True,
+        editable=False,
+    )
+    image_height = models.IntegerField(
+        'Высота картинки',
+        null=True,
+        blank=True,
+        editable=False,
+    )
+    image_placeholder = models.TextField(
+        'Заглушка картинки',
+        null=True,
+        blank=True,
+        editable=False,
+    )
     condition = models.ManyToManyField(
         Condition,
         through='PromotionCondition',
@@ -186,6 +227,24 @@ class Banner(models.Model):
         'Картинка',
         upload_to='banners/images/',
     )
+    image_width = models.IntegerField(
+        'Ширина картинки',
+        null=True,
+        blank=True,
+        editable=False,
+    )
+    image_height = models.IntegerField(
+        'Высота картинки',
+        null=True,
+        blank=True,
+        editable=False,
+    )
+    image_placeholder = models.TextField(
+        'Заглушка картинки',
+        null=True,
+        blank=True,
+        editable=False,
+    )
 
     def __str__(self):
         return self.title
@@ -213,6 +272,24 @@ class Category(TimeBasedModel):
         'Картинка',
         upload_to='categories/images/',
     )
+    image_width = models.IntegerField(
+        'Ширина картинки',
+        null=True,
+        blank=True,
+        editable=False,
+    )
+    image_height = models.IntegerField(
+        'Высота картинки',
+        null=True,
+        blank=True,
+        editable=False,
+    )
+    image_placeholder = models.TextField(
+        'Заглушка картинки',
+        null=True,
+        blank=True,
+        editable=False,
+    )
     banner = models.ManyToManyField(
         Banner,
         through='CategoryBanner',
@@ -245,6 +322,18 @@ class Product(TimeBasedModel):
         verbose_name = 'Товар'
         verbose_name_plural = 'Товары'
         ordering = ['-created_at']
+        indexes = [
+            # Под курсорную пагинацию api.pagination.ProductPagination
+            models.Index(
+                fields=['-created_at', '-id'],
+                name='product_created_at_id_idx',
+            ),
+            # Под полнотекстовый поиск api.search
+            GinIndex(
+                fields=['search_vector'],
+                name='product_search_vector_idx',
+            ),
+        ]
 
     category = models.ManyToManyField(
         Category,
@@ -315,6 +404,79 @@ class Product(TimeBasedModel):
         upload_to='products/images/',
         blank=True,
     )
+    image_width = models.IntegerField(
+        'Ширина картинки',
+        null=True,
+        blank=True,
+        editable=False,
+    )
+    image_height = models.IntegerField(
+        'Высота картинки',
+        null=True,
+        blank=True,
+        editable=False,
+    )
+    image_placeholder = models.TextField(
+        'Заглушка картинки',
+        null=True,
+        blank=True,
+        editable=False,
+    )
+
+    # Предрассчитанные значения, пересчитываются в api.metrics
+    total_weight = models.IntegerField(
+        'Общий вес',
+        null=True,
+        blank=True,
+        editable=False,
+    )
+    amount = models.IntegerField(
+        'Количество штук',
+        null=True,
+        blank=True,
+        editable=False,
+    )
+    min_price = models.IntegerField(
+        'Минимальная цена',
+        null=True,
+        blank=True,
+        editable=False,
+    )
+    max_price = models.IntegerField(
+        'Максимальная цена',
+        null=True,
+        blank=True,
+        editable=False,
+    )
+    total_calorie = models.IntegerField(
+        'Калории набора',
+        null=True,
+        blank=True,
+        editable=False,
+    )
+    total_proteins = models.IntegerField(
+        'Белки набора',
+        null=True,
+        blank=True,
+        editable=False,
+    )
+    total_fats = models.IntegerField(
+        'Жиры набора',
+        null=True,
+        blank=True,
+        editable=False,
+    )
+    total_carbohydrates = models.IntegerField(
+        'Углероды набора',
+        null=True,
+        blank=True,
+        editable=False,
+    )
+    # Обновляется при сохранении товара, см. api.search
+    search_vector = SearchVectorField(
+        null=True,
+        editable=False,
+    )
 
     def __str__(self):
         return f'{self.category} - {self.name}'
@@ -421,6 +583,24 @@ class Collection(models.Model):
         default=True,
     )
 
+    objects = CollectionManager()
+
+    def clean(self):
+        if Collection.objects.creates_cycle(
+                self.parent_product_id, self.child_product_id):
+            raise ValidationError({
+                'child_product': 'Набор не может входить сам в себя',
+            })
+
+    def save(self, *args, **kwargs):
+        # Проверка и вне админки, чтобы обход наборов не зациклился.
+        # bulk_create и update() save не вызывают и не проверяются,
+        # такие записи проверяем сами через creates_cycle
+        with transaction.atomic():
+            Collection.objects.lock()
+            self.clean()
+            super().save(*args, **kwargs)
+
 
 # Модели для Location
 class Country(models.Model):
@@ -464,3 +644,78 @@ class City(models.Model):
 
     def __str__(self):
         return f'{self.country} - {self.name}'
+
+
+# Почта
+class OutgoingEmail(models.Model):
+    class Meta:
+        verbose_name = 'Письмо'
+        verbose_name_plural = 'Исходящие письма'
+        indexes = [
+            # Очередь неотправленных писем для run_mail_worker
+            models.Index(
+                fields=('send_after', 'id'),
+                name='outgoingemail_queue_idx',
+                condition=models.Q(
+                    sent_at__isnull=True, failed_at__isnull=True),
+            ),
+        ]
+
+    to = models.EmailField(
+        'Получатель',
+        max_length=255,
+    )
+    subject = models.CharField(
+        'Тема',
+        max_length=255,
+    )
+    body = models.TextField(
+        'Текст',
+        blank=True,
+    )
+    html_body = models.TextField(
+        'HTML',
+        blank=True,
+    )
+    created_at = models.DateTimeField(
+        'Дата создания',
+        auto_now_add=True,
+    )
+    send_after = models.DateTimeField(
+        'Отправить после',
+        default=timezone.now,
+    )
+    # Письмо с кодом после истечения кода отправлять незачем
+    expires_at = models.DateTimeField(
+        'Не отправлять после',
+        null=True,
+        blank=True,
+    )
+    # Пока письмо отправляется, другие воркеры его не берут
+    locked_until = models.DateTimeField(
+        'Занято воркером до',
+        null=True,
+        blank=True,
+    )
+    sent_at = models.DateTimeField(
+        'Дата отправки',
+        null=True,
+        blank=True,
+    )
+    # Письмо больше не отправляется: истек срок или кончились попытки
+    failed_at = models.DateTimeField(
+        'Дата отказа',
+        null=True,
+        blank=True,
+    )
+    attempts = models.PositiveSmallIntegerField(
+        'Попыток',
+        default=0,
+    )
+    last_error = models.TextField(
+        'Последняя ошибка',
+        blank=True,
+    )
+
+    def __str__(self):
+        return f'{self.to} - {self.subject}'
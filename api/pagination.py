@@ -0,0 +1,127 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import date
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(CursorPagination):
+    """
+    Курсорная пагинация по ключу сортировки вместе с id.
+    Курсор хранит значения крайней строки страницы, поэтому нет
+    ни OFFSET, ни COUNT(*), и глубокие страницы не медленнее первой.
+    """
+
+    ordering = ('-id',)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.model = queryset.model
+        self.cursor = self.decode_cursor(request)
+
+        reverse = self.cursor is not None and self.cursor['reverse']
+        ordering = self.get_ordering_fields(reverse)
+        if self.cursor is not None:
+            queryset = queryset.filter(
+                self.keyset_filter(ordering, self.cursor['values']))
+
+        rows = list(queryset.order_by(*ordering)[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        self.page = rows[:self.page_size]
+
+        if reverse:
+            self.page.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = self.cursor is not None
+        return self.page
+
+    def get_ordering_fields(self, reverse=False):
+        if not reverse:
+            return self.ordering
+        return tuple(
+            field[1:] if field.startswith('-') else f'-{field}'
+            for field in self.ordering
+        )
+
+    @staticmethod
+    def keyset_filter(ordering, values):
+        """
+        (a, b) < (x, y) в виде a < x OR (a = x AND b < y).
+        Дополнительное a <= x дает Postgres границу для индекса.
+        """
+
+        names = [field.lstrip('-') for field in ordering]
+        condition = Q()
+        for index, field in enumerate(ordering):
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            condition |= Q(
+                **dict(zip(names[:index], values[:index])),
+                **{f'{names[index]}__{lookup}': values[index]},
+            )
+
+        lookup = 'lte' if ordering[0].startswith('-') else 'gte'
+        return Q(**{f'{names[0]}__{lookup}': values[0]}) & condition
+
+    def get_row_values(self, row):
+        return [
+            getattr(row, field.lstrip('-')) for field in self.ordering
+        ]
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+
+        try:
+            encoded += '=' * (-len(encoded) % 4)
+            cursor = json.loads(urlsafe_b64decode(encoded.encode()))
+            if len(cursor['v']) != len(self.ordering):
+                raise ValueError
+            values = [
+                self.model._meta.get_field(field.lstrip('-')).to_python(value)
+                for field, value in zip(self.ordering, cursor['v'])
+            ]
+            return {'reverse': bool(cursor['r']), 'values': values}
+        except (TypeError, ValueError, KeyError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def cursor_link(self, reverse, values):
+        values = [
+            value.isoformat() if isinstance(value, date) else value
+            for value in values
+        ]
+        encoded = urlsafe_b64encode(
+            json.dumps({'r': reverse, 'v': values}).encode())
+        return replace_query_param(
+            self.base_url,
+            self.cursor_query_param,
+            encoded.decode().rstrip('='),
+        )
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.cursor_link(False, self.get_row_values(self.page[-1]))
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.cursor_link(True, self.get_row_values(self.page[0]))
+
+
+class ProductPagination(KeysetPagination):
+    ordering = ('-created_at', '-id')
+
+
+class UserPagination(KeysetPagination):
+    ordering = ('id',)
@@ -0,0 +1,172 @@
+import logging
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import ForeignObjectRel, Prefetch, Q
+from rest_framework import serializers
+
+from .fieldsets import SparseFieldsetMixin, parse_fieldset, prune_fields
+
+logger = logging.getLogger(__name__)
+
+
+class UncoveredRelationError(Exception):
+    pass
+
+
+class PlanNode:
+    """
+    Узел prefetch плана: модель, связи для select_related
+    и вложенные Prefetch для связей "ко многим".
+    """
+
+    def __init__(self, model, back_name=None):
+        self.model = model
+        # FK на родителя, который Django кладет в кеш сам при prefetch
+        self.back_name = back_name
+        self.select = set()
+        self.prefetch = {}
+
+    def apply(self, queryset=None, filters=None):
+        """
+        filters - условия для Prefetch этого узла, {'products': Q(...)}.
+        """
+
+        if queryset is None:
+            queryset = self.model._default_manager.all()
+        if self.select:
+            queryset = queryset.select_related(*sorted(self.select))
+        if self.prefetch:
+            filters = filters or {}
+            queryset = queryset.prefetch_related(*(
+                Prefetch(lookup, queryset=node.apply().filter(
+                    filters.get(lookup, Q())))
+                for lookup, node in sorted(self.prefetch.items())
+            ))
+        return queryset
+
+
+def get_relation(model, name):
+    for field in model._meta.get_fields():
+        if not field.is_relation:
+            continue
+        if isinstance(field, ForeignObjectRel):
+            accessor = field.get_accessor_name()
+        else:
+            accessor = field.name
+        if accessor == name:
+            return field
+    return None
+
+
+def resolve_path(node, prefix, model, attrs):
+    """
+    Проходит по атрибутам source и добавляет в план нужные связи.
+    Возвращает позицию (узел, префикс, модель), в которой оказались.
+    """
+
+    for name in attrs:
+        field = get_relation(model, name)
+        if field is None:
+            break
+        if field.many_to_many or field.one_to_many:
+            if prefix:
+                node.select.add('__'.join(prefix))
+            back_name = field.field.name if field.one_to_many else None
+            node = node.prefetch.setdefault(
+                '__'.join([*prefix, name]),
+                PlanNode(field.related_model, back_name),
+            )
+            prefix = []
+        else:
+            if prefix or name != node.back_name:
+                node.select.add('__'.join([*prefix, name]))
+            prefix = [*prefix, name]
+        model = field.related_model
+    return node, prefix, model
+
+
+def walk_serializer(serializer, node, prefix, model):
+    hints = getattr(getattr(serializer, 'Meta', None), 'prefetch_hints', {})
+
+    for name, field in serializer.fields.items():
+        if field.write_only:
+            continue
+        if isinstance(field, serializers.SerializerMethodField):
+            for path in hints.get(name) or ():
+                resolve_path(node, prefix, model, path.split('.'))
+            continue
+
+        attrs = [] if field.source == '*' else field.source_attrs
+        position = resolve_path(node, prefix, model, attrs)
+        if isinstance(field, serializers.ListSerializer):
+            field = field.child
+        if isinstance(field, serializers.BaseSerializer):
+            walk_serializer(field, *position)
+
+
+class PrefetchPlan:
+    """
+    Набор select_related/Prefetch, который покрывает все дерево
+    сериализатора: вложенные сериализаторы, source='a.b.c'
+    и связи из Meta.prefetch_hints для SerializerMethodField.
+    """
+
+    def __init__(self, serializer):
+        if isinstance(serializer, serializers.ListSerializer):
+            serializer = serializer.child
+        self.root = PlanNode(serializer.Meta.model)
+        walk_serializer(serializer, self.root, [], self.root.model)
+
+    def apply(self, queryset, filters=None):
+        return self.root.apply(queryset, filters)
+
+
+@lru_cache(maxsize=256)
+def plan_for(serializer_class, fields=None, omit=None):
+    serializer = serializer_class()
+    if (fields or omit) and issubclass(serializer_class, SparseFieldsetMixin):
+        prune_fields(serializer, parse_fieldset(fields), parse_fieldset(omit))
+    return PrefetchPlan(serializer)
+
+
+class QueryTrap:
+    def __init__(self, serializer, field_name):
+        self.location = f'{type(serializer).__name__}.{field_name}'
+
+    def __call__(self, execute, sql, params, many, context):
+        message = (f'{self.location} обращается к связи, '
+                   f'не покрытой prefetch планом: {sql}')
+        if settings.PREFETCH_GUARD_STRICT:
+            raise UncoveredRelationError(message)
+        logger.warning(message)
+        return execute(sql, params, many, context)
+
+
+def guard_method_fields(serializer):
+    """
+    Оборачивает SerializerMethodField так, чтобы любой запрос в базу
+    из get_<field> попадал в лог (или падал в строгом режиме).
+    Поля с prefetch_hints = None сами ходят в базу и не проверяются.
+    """
+
+    if isinstance(serializer, serializers.ListSerializer):
+        serializer = serializer.child
+    hints = getattr(getattr(serializer, 'Meta', None), 'prefetch_hints', {})
+
+    for name, field in serializer.fields.items():
+        if isinstance(field, serializers.SerializerMethodField):
+            if name in hints and hints[name] is None:
+                continue
+            field.to_representation = guarded(
+                field.to_representation, QueryTrap(serializer, name))
+        elif isinstance(field, serializers.BaseSerializer):
+            guard_method_fields(field)
+
+
+def guarded(method, trap):
+    def wrapper(value):
+        with connection.execute_wrapper(trap):
+            return method(value)
+    return wrapper
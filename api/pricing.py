@@ -0,0 +1,81 @@
+from django.db.models import Case, F, IntegerField, Q, When
+from django.db.models.functions import Cast
+
+from .models import ProductSize
+
+
+def discount_price(price, discount):
+    """
+    Цена со скидкой в процентах, округленная вверх.
+    Считается в целых числах, без ошибок округления float.
+    """
+
+    if discount:
+        return (price * (100 - discount) + 99) // 100
+    return price
+
+
+def discount_price_expression():
+    # То же, что discount_price, но в SQL для всех строк сразу
+    return Case(
+        When(
+            Q(product__discount__gt=0),
+            then=Cast(
+                (F('price') * (100 - F('product__discount')) + 99) / 100,
+                IntegerField(),
+            ),
+        ),
+        default=F('price'),
+        output_field=IntegerField(),
+    )
+
+
+def quote_cart(lines):
+    """
+    Считает корзину из строк {'product_id', 'size_id', 'qty'}.
+    Цены со скидкой для всех строк берутся одним запросом.
+    """
+
+    product_ids = {line['product_id'] for line in lines}
+    size_ids = {line['size_id'] for line in lines}
+    prices = {}
+    rows = ProductSize.objects.filter(
+        product_id__in=product_ids,
+        size_id__in=size_ids,
+    ).order_by('pk').values_list(
+        'product_id',
+        'size_id',
+        'price',
+        discount_price_expression(),
+        'product__promotion__slug',
+    )
+    for product_id, size_id, *row in rows:
+        prices[product_id, size_id] = row
+
+    result = []
+    missing = []
+    total = 0
+    full_total = 0
+    for line in lines:
+        key = (line['product_id'], line['size_id'])
+        if key not in prices:
+            missing.append({'product_id': key[0], 'size_id': key[1]})
+            continue
+        price, unit_price, promotion = prices[key]
+        line_total = unit_price * line['qty']
+        total += line_total
+        full_total += price * line['qty']
+        result.append({
+            **line,
+            'price': price,
+            'discount_price': unit_price,
+            'total': line_total,
+            'promotion': promotion,
+        })
+
+    return {
+        'lines': result,
+        'missing': missing,
+        'total': total,
+        'discount': full_total - total,
+    }
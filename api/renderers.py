@@ -0,0 +1,33 @@
+import orjson
+from rest_framework.renderers import BaseRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+# Уже закодированный JSON, который вставляется в ответ как есть
+Fragment = orjson.Fragment
+
+
+class ORJSONRenderer(BaseRenderer):
+    """
+    JSON через orjson. Принимает Fragment с готовыми байтами,
+    русский текст и '₽' пишет без экранирования.
+    """
+
+    media_type = 'application/json'
+    format = 'json'
+    charset = None
+    options = (
+        orjson.OPT_NON_STR_KEYS
+        | orjson.OPT_PASSTHROUGH_DATETIME
+        | orjson.OPT_PASSTHROUGH_DATACLASS
+    )
+    # Типы, которые orjson не знает, кодируем так же, как DRF
+    default = staticmethod(JSONEncoder().default)
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+
+        options = self.options
+        if accepted_media_type and 'indent' in accepted_media_type:
+            options |= orjson.OPT_INDENT_2
+        return orjson.dumps(data, default=self.default, option=options)
@@ -0,0 +1,46 @@
+from django.contrib.postgres.search import (
+    SearchQuery,
+    SearchRank,
+    SearchVector,
+)
+from django.db.models import F
+
+from .models import Product
+
+SEARCH_CONFIG = 'russian'
+
+# Поля товара, из которых собирается search_vector
+SEARCH_FIELDS = ('name', 'description')
+
+
+def product_search_vector():
+    """
+    Название весит больше описания, поэтому совпадения
+    в названии поднимаются выше при ранжировании.
+    """
+
+    return (
+        SearchVector('name', weight='A', config=SEARCH_CONFIG)
+        + SearchVector('description', weight='B', config=SEARCH_CONFIG)
+    )
+
+
+def update_search_vector(product_ids):
+    Product.objects.filter(pk__in=product_ids).update(
+        search_vector=product_search_vector())
+
+
+def search_products(queryset, query):
+    """
+    Товары, подходящие под запрос, по убыванию релевантности.
+    Фильтр по search_vector идет через GIN индекс, ранг считается
+    только для найденных строк.
+    """
+
+    search_query = SearchQuery(
+        query, config=SEARCH_CONFIG, search_type='websearch')
+    return queryset.filter(
+        search_vector=search_query,
+    ).annotate(
+        rank=SearchRank(F('search_vector'), search_query),
+    ).order_by('-rank', '-id')
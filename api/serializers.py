@@ -1,8 +1,11 @@
-import math
-
 from rest_framework import serializers
-from rest_framework_simplejwt import tokens
 
+from .backends import get_token
+from .fieldsets import SparseFieldsetMixin
+from .images import image_srcset
+from .pricing import discount_price
+from .sprites import get_sprite_url, icon_sprite
+from .tags import get_category_tags
 from .models import (
     Product,
     Property,
@@ -19,21 +22,83 @@ from .models import (
 )
 
 
+def last_size(product):
+    """
+    Аналог product.sizes.last(), который берет размеры из prefetch
+    и не делает отдельный запрос в базу.
+    """
+    return max(product.sizes.all(), key=lambda size: size.pk, default=None)
+
+
+def format_amount(product):
+    if product.amount is None:
+        return None
+    return f'{product.amount} шт'
+
+
+def get_kpfc(product):
+    """
+    КБЖУ товара. Если у набора свои значения не заполнены,
+    берем сумму по его составу.
+    """
+    return {
+        field: (
+            getattr(product, field)
+            if getattr(product, field) is not None
+            else getattr(product, f'total_{field}')
+        )
+        for field in ('calorie', 'proteins', 'fats', 'carbohydrates')
+    }
+
+
+def format_discount_price(product_size):
+    discount = product_size.product.discount
+    if discount:
+        return f'{discount_price(product_size.price, discount)}₽'
+    return product_size.price
+
+
+def format_component_name(collection):
+    product = collection.child_product
+    if collection.is_full:
+        return product.name
+    elif last_size(product).size.measurement == 'шт':
+        if len(product.sizes.all()) > 1:
+            return f'{product.name} 1/2'
+        return product.name
+    return f'{product.name} {last_size(product).size.size}см'
+
+
 class PropertySerializer(serializers.ModelSerializer):
     class Meta:
         model = Property
-        fields = ('pk', 'name', 'icon')
+        fields = (
+            'pk', 'name', 'icon', 'icon_sprite', 'icon_width', 'icon_height',
+            'icon_placeholder')
 
     icon = serializers.SerializerMethodField()
+    icon_sprite = serializers.SerializerMethodField()
 
     def get_icon(self, obj):
-        return '/media/' + obj.icon.name
+        if obj.icon:
+            return obj.icon.url
+
+    def get_icon_sprite(self, obj):
+        # Адрес спрайта один на весь ответ: берем его один раз
+        # и храним в общем контексте сериализаторов
+        if 'sprite_url' not in self.context:
+            self.context['sprite_url'] = get_sprite_url()
+        return icon_sprite(obj, self.context['sprite_url'])
 
 
 class SizeProductSerializer(serializers.ModelSerializer):
     class Meta:
         model = ProductSize
         fields = ('pk', 'size', 'price', 'discount_price', 'weight')
+        prefetch_hints = {
+            'size': ('size',),
+            'discount_price': ('product',),
+        }
 
     pk = serializers.PrimaryKeyRelatedField(
         queryset=Size.objects.all(),
@@ -51,9 +116,7 @@ class SizeProductSerializer(serializers.ModelSerializer):
         return f'{obj.price}₽'
 
     def get_discount_price(self, obj):
-        if obj.product.discount:
-            return f'{math.ceil(obj.price * (1 - obj.product.discount / 100))}₽'
-        return obj.price
+        return format_discount_price(obj)
 
     def get_weight(self, obj):
         return obj.weight
@@ -68,29 +131,61 @@ class ShortPromotionSerializer(serializers.ModelSerializer):
 class BannerSerializer(serializers.ModelSerializer):
     class Meta:
         model = Banner
-        fields = ('pk', 'title', 'description', 'image', 'slug')
+        fields = (
+            'pk',
+            'title',
+            'description',
+            'image',
+            'image_srcset',
+            'image_width',
+            'image_height',
+            'image_placeholder',
+            'slug',
+        )
 
     image = serializers.SerializerMethodField()
+    image_srcset = serializers.SerializerMethodField()
 
     def get_image(self, obj):
-        return '/media/' + obj.image.name
+        return obj.image.url
+
+    def get_image_srcset(self, obj):
+        return image_srcset(obj.image)
 
 
 # Promotion
-class PromotionSerializer(serializers.ModelSerializer):
+class PromotionSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     class Meta:
         model = Promotion
-        fields = ('pk', 'title', 'description', 'slug', 'image', 'conditions')
+        fields = (
+            'pk',
+            'title',
+            'description',
+            'slug',
+            'image',
+            'image_srcset',
+            'image_width',
+            'image_height',
+            'image_placeholder',
+            'conditions',
+        )
+        prefetch_hints = {
+            'conditions': ('conditions.condition',),
+        }
         lookup_field = 'slug'
         extra_kwargs = {
             'url': {'lookup_field': 'slug'}
         }
 
     image = serializers.SerializerMethodField()
+    image_srcset = serializers.SerializerMethodField()
     conditions = serializers.SerializerMethodField()
 
     def get_image(self, obj):
-        return '/media/' + obj.image.name
+        return obj.image.url
+
+    def get_image_srcset(self, obj):
+        return image_srcset(obj.image)
 
     def get_conditions(self, obj):
         conditions = [value.condition.name for value in obj.conditions.all()]
@@ -105,31 +200,51 @@ class PromotionSerializer(serializers.ModelSerializer):
 class ShortProductSerializer(serializers.ModelSerializer):
     class Meta:
         model = Collection
-        fields = ('pk', 'name', 'description', 'image')
+        fields = (
+            'pk',
+            'name',
+            'description',
+            'image',
+            'image_srcset',
+            'image_width',
+            'image_height',
+            'image_placeholder',
+        )
+        prefetch_hints = {
+            'name': ('child_product.sizes.size',),
+            'image': ('child_product',),
+            'image_srcset': ('child_product',),
+            'image_width': ('child_product',),
+            'image_height': ('child_product',),
+            'image_placeholder': ('child_product',),
+        }
 
     pk = serializers.PrimaryKeyRelatedField(
         queryset=Product.objects.all(), source='child_product.id')
     name = serializers.SerializerMethodField(source='child_product.name')
     description = serializers.CharField(source='child_product.description')
     image = serializers.SerializerMethodField()
+    image_srcset = serializers.SerializerMethodField()
+    image_width = serializers.IntegerField(
+        source='child_product.image_width', read_only=True)
+    image_height = serializers.IntegerField(
+        source='child_product.image_height', read_only=True)
+    image_placeholder = serializers.CharField(
+        source='child_product.image_placeholder', read_only=True)
 
     def get_name(self, obj):
-        if obj.is_full:
-            return obj.child_product.name
-        elif obj.child_product.sizes.last().size.measurement == 'шт':
-            if len(obj.child_product.sizes.all()) > 1:
-                return f'{obj.child_product.name} 1/2'
-            return obj.child_product.name
-        return (f'{obj.child_product.name} '
-                f'{obj.child_product.sizes.last().size.size}см')
+        return format_component_name(obj)
 
     def get_image(self, obj):
         if obj.child_product.image.name:
-            return '/media/' + obj.child_product.image.name
+            return obj.child_product.image.url
+
+    def get_image_srcset(self, obj):
+        return image_srcset(obj.child_product.image)
 
 
 # Product
-class ProductSerializer(serializers.ModelSerializer):
+class ProductSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     class Meta:
         model = Product
         fields = (
@@ -142,67 +257,37 @@ class ProductSerializer(serializers.ModelSerializer):
             'amount',
             'kpfc',
             'image',
+            'image_srcset',
+            'image_width',
+            'image_height',
+            'image_placeholder',
             'components',
             'properties',
             'sizes',
         )
 
-    total_weight = serializers.SerializerMethodField()
     amount = serializers.SerializerMethodField()
     kpfc = serializers.SerializerMethodField()
     image = serializers.SerializerMethodField()
+    image_srcset = serializers.SerializerMethodField()
     promotion = ShortPromotionSerializer(read_only=True)
     components = ShortProductSerializer(many=True, read_only=True)
     properties = PropertySerializer(
         many=True, read_only=True, source='property')
     sizes = SizeProductSerializer(many=True, read_only=True)
 
-    def get_total_weight(self, obj):
-        total_weight = 0
-
-        for collection in obj.components.all():
-            sizes = [size.weight for size in collection.child_product.sizes.all()]
-            if collection.is_full:
-                total_weight += max(sizes)
-                continue
-            total_weight += min(sizes)
-
-        if not total_weight:
-            return None
-        return total_weight
-
     def get_amount(self, obj):
-        if not obj.components.all():
-            return None
-
-        amount = 0
-
-        for collection in obj.components.all():
-            print(collection.child_product.sizes.all())
-            if collection.child_product.sizes.last().size.measurement == 'см':
-                return None
-            sorted_sizes = sorted(
-                map(lambda x: x.size.size, collection.child_product.sizes.all())
-            )
-
-            if collection.is_full:
-                amount += sorted_sizes[-1]
-            else:
-                amount += sorted_sizes[0]
-
-        return f'{amount} шт'
+        return format_amount(obj)
 
     def get_kpfc(self, obj):
-        return {
-            'calorie': obj.calorie,
-            'proteins': obj.proteins,
-            'fats': obj.fats,
-            'carbohydrates': obj.carbohydrates
-        }
+        return get_kpfc(obj)
 
     def get_image(self, obj):
         if obj.image:
-            return '/media/' + obj.image.name
+            return obj.image.url
+
+    def get_image_srcset(self, obj):
+        return image_srcset(obj.image)
 
 
 # Category
@@ -219,10 +304,23 @@ class CategoryProductsSerializer(serializers.ModelSerializer):
             'amount',
             'kpfc',
             'image',
+            'image_srcset',
+            'image_width',
+            'image_height',
+            'image_placeholder',
             'components',
             'properties',
             'sizes',
         )
+        prefetch_hints = {
+            'amount': ('product',),
+            'kpfc': ('product',),
+            'image': ('product',),
+            'image_srcset': ('product',),
+            'image_width': ('product',),
+            'image_height': ('product',),
+            'image_placeholder': ('product',),
+        }
 
     pk = serializers.PrimaryKeyRelatedField(
         source='product.pk', read_only=True)
@@ -230,76 +328,70 @@ class CategoryProductsSerializer(serializers.ModelSerializer):
     description = serializers.CharField(source='product.description')
     promotion = ShortPromotionSerializer(
         read_only=True, source='product.promotion')
-    total_weight = serializers.SerializerMethodField()
+    total_weight = serializers.IntegerField(
+        source='product.total_weight', read_only=True)
     amount = serializers.SerializerMethodField()
     discount = serializers.IntegerField(source='product.discount')
     kpfc = serializers.SerializerMethodField()
     image = serializers.SerializerMethodField()
+    image_srcset = serializers.SerializerMethodField()
+    image_width = serializers.IntegerField(
+        source='product.image_width', read_only=True)
+    image_height = serializers.IntegerField(
+        source='product.image_height', read_only=True)
+    image_placeholder = serializers.CharField(
+        source='product.image_placeholder', read_only=True)
     components = ShortProductSerializer(many=True, read_only=True, source='product.components')
     properties = PropertySerializer(
         many=True, read_only=True, source='product.property')
     sizes = SizeProductSerializer(
         many=True, read_only=True, source='product.sizes')
 
-    def get_total_weight(self, obj):
-        total_weight = 0
-
-        for collection in obj.product.components.all():
-            sizes = [size.weight for size in collection.child_product.sizes.all()]
-            if collection.is_full:
-                total_weight += max(sizes)
-                continue
-            total_weight += min(sizes)
-
-        if not total_weight:
-            return None
-        return total_weight
-
     def get_amount(self, obj):
-        if not obj.product.components.all():
-            return None
-
-        amount = 0
-
-        for collection in obj.product.components.all():
-            if collection.child_product.sizes.last().size.measurement == 'см':
-                return None
-            sorted_sizes = sorted(
-                map(lambda x: x.size.size, collection.child_product.sizes.all())
-            )
-
-            if collection.is_full:
-                amount += sorted_sizes[-1]
-            else:
-                amount += sorted_sizes[0]
-
-        return f'{amount} шт'
+        return format_amount(obj.product)
 
     def get_kpfc(self, obj):
-        return {
-            'calorie': obj.product.calorie,
-            'proteins': obj.product.proteins,
-            'fats': obj.product.fats,
-            'carbohydrates': obj.product.carbohydrates
-        }
+        return get_kpfc(obj.product)
 
     def get_image(self, obj):
         if obj.product.image:
-            return '/media/' + obj.product.image.name
+            return obj.product.image.url
+
+    def get_image_srcset(self, obj):
+        return image_srcset(obj.product.image)
 
 
-class ShortCategorySerializer(serializers.ModelSerializer):
+class ShortCategorySerializer(
+    SparseFieldsetMixin,
+    serializers.ModelSerializer,
+):
     class Meta:
         model = Category
-        fields = ('pk', 'name', 'slug', 'image')
+        fields = (
+            'pk',
+            'name',
+            'slug',
+            'image',
+            'image_srcset',
+            'image_width',
+            'image_height',
+            'image_placeholder',
+        )
 
     image = serializers.SerializerMethodField()
+    image_srcset = serializers.SerializerMethodField()
 
     def get_image(self, obj):
-        return '/media/' + obj.image.name
+        return obj.image.url
+
+    def get_image_srcset(self, obj):
+        return image_srcset(obj.image)
 
 
-class CategorySerializer(serializers.HyperlinkedModelSerializer):
+class CategorySerializer(
+    SparseFieldsetMixin,
+    serializers.HyperlinkedModelSerializer,
+):
     class Meta:
         model = Category
         fields = (
@@ -308,6 +400,10 @@ class CategorySerializer(serializers.HyperlinkedModelSerializer):
             'description',
             'slug',
             'image',
+            'image_srcset',
+            'image_width',
+            'image_height',
+            'image_placeholder',
             'banners',
             'products',
             'tags',
@@ -316,28 +412,26 @@ class CategorySerializer(serializers.HyperlinkedModelSerializer):
         extra_kwargs = {
             'url': {'lookup_field': 'slug'}
         }
+        prefetch_hints = {
+            # Теги считаются отдельным агрегатным запросом с кешем
+            'tags': None,
+        }
 
     image = serializers.SerializerMethodField()
+    image_srcset = serializers.SerializerMethodField()
     banners = BannerSerializer(many=True, read_only=True, source='banner')
     products = CategoryProductsSerializer(
         many=True, read_only=True)
     tags = serializers.SerializerMethodField()
 
     def get_image(self, obj):
-        return '/media/' + obj.image.name
+        return obj.image.url
+
+    def get_image_srcset(self, obj):
+        return image_srcset(obj.image)
 
     def get_tags(self, obj):
-        result = []
-        for product in obj.products.all():
-            for tag in product.product.properties.all():
-                result.append(
-                    {
-                        'pk': tag.property.pk,
-                        'name': tag.property.name,
-                        'slug': tag.property.slug,
-                    }
-                )
-        return result
+        return get_category_tags(obj.pk)
 
 
 # Для Users
@@ -378,7 +472,7 @@ class UserMeSerializer(serializers.ModelSerializer):
         data = super().to_representation(instance)
         user = self.context['user']
 
-        refresh = tokens.RefreshToken.for_user(user)
+        refresh = get_token(user)
 
         data['access'] = str(refresh.access_token)
         data['refresh'] = str(refresh)
@@ -395,6 +489,32 @@ class EmailLoginSerializer(serializers.ModelSerializer):
         }
 
 
+class ProductIdsSerializer(serializers.Serializer):
+    max_ids = 300
+
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=max_ids,
+    )
+
+
+class CartLineSerializer(serializers.Serializer):
+    product_id = serializers.IntegerField(min_value=1)
+    size_id = serializers.IntegerField(min_value=1)
+    qty = serializers.IntegerField(min_value=1, max_value=999)
+
+
+class CartQuoteSerializer(serializers.Serializer):
+    max_lines = 1000
+
+    lines = CartLineSerializer(
+        many=True,
+        allow_empty=False,
+        max_length=max_lines,
+    )
+
+
 class SetPasswordSerializer(serializers.Serializer):
     password = serializers.CharField(write_only=True)
     re_password = serializers.CharField(write_only=True)
@@ -417,13 +537,11 @@ class CodeSerializer(serializers.Serializer):
         if len(code) > 5:
             raise serializers.ValidationError(
                 'Поле code должно быть меньше 5')
-        for v in code:
-            try:
-                int(v)
-            except Exception:
-                raise serializers.ValidationError(
-                    'Поле code должна состоять из цифр'
-                )
+        # isdigit пропускает и не ASCII цифры, например '١٢٣٤٥'
+        if not (code.isascii() and code.isdigit()):
+            raise serializers.ValidationError(
+                'Поле code должна состоять из цифр'
+            )
 
         return data
 
@@ -438,6 +556,9 @@ class LocationSerializer(serializers.ModelSerializer):
     class Meta:
         model = Country
         fields = ('pk', 'country', 'cities')
+        prefetch_hints = {
+            'cities': ('cities',),
+        }
 
     country = serializers.CharField(source='name')
     cities = serializers.SerializerMethodField()
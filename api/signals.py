@@ -0,0 +1,185 @@
+from django.db.models.signals import (
+    post_save,
+    post_delete,
+    pre_delete,
+    pre_save,
+)
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .images import IMAGE_FIELDS, info_fields, schedule_image
+from .metrics import METRIC_FIELDS, get_parent_ids, schedule_metrics_refresh
+from .models import (
+    Product,
+    ProductSize,
+    Collection,
+    Size,
+    Category,
+    ProductCategory,
+    ProductProperty,
+    Property,
+    Banner,
+    CategoryBanner,
+    Promotion,
+)
+from .search import SEARCH_FIELDS, update_search_vector
+from .snapshots import schedule_catalog_invalidation
+from .sprites import schedule_sprite_rebuild
+from .suggest import schedule_suggest_update
+from .tags import get_product_category_ids, schedule_tags_invalidation
+
+# Модели, из которых собирается меню категории
+CATALOG_MODELS = (
+    Category,
+    Product,
+    ProductCategory,
+    ProductSize,
+    Collection,
+    ProductProperty,
+    Property,
+    Size,
+    Banner,
+    CategoryBanner,
+    Promotion,
+)
+
+
+# updated_at используется для ETag/Last-Modified, поэтому его
+# обновляем и при изменении связанных строк без своего updated_at
+def touch_products(product_ids):
+    product_ids = set(product_ids)
+    product_ids |= get_parent_ids(product_ids)
+    Product.objects.filter(pk__in=product_ids).update(
+        updated_at=timezone.now())
+
+
+def touch_categories(category_ids):
+    Category.objects.filter(pk__in=set(category_ids)).update(
+        updated_at=timezone.now())
+
+
+@receiver((post_save, post_delete), sender=Collection)
+def collection_changed(sender, instance, **kwargs):
+    schedule_metrics_refresh([instance.parent_product_id])
+    touch_products([instance.parent_product_id])
+
+
+@receiver((post_save, post_delete), sender=ProductSize)
+def product_size_changed(sender, instance, **kwargs):
+    schedule_metrics_refresh([instance.product_id])
+    touch_products([instance.product_id])
+
+
+@receiver(post_save, sender=Size)
+def size_changed(sender, instance, **kwargs):
+    product_ids = instance.products.values_list('product_id', flat=True)
+    schedule_metrics_refresh(product_ids)
+    touch_products(product_ids)
+
+
+@receiver(post_save, sender=Product)
+def product_changed(sender, instance, update_fields=None, **kwargs):
+    if update_fields and set(update_fields) <= set(METRIC_FIELDS):
+        return
+    # КБЖУ товара входит в КБЖУ наборов, в которых он лежит,
+    # а название и картинка - в их состав
+    parent_ids = get_parent_ids([instance.pk])
+    if parent_ids:
+        schedule_metrics_refresh(parent_ids)
+        touch_products(parent_ids)
+
+
+@receiver(post_save, sender=Product)
+def product_text_changed(sender, instance, update_fields=None, **kwargs):
+    if update_fields and not set(update_fields) & set(SEARCH_FIELDS):
+        return
+    update_search_vector([instance.pk])
+    schedule_suggest_update(instance.pk, instance.name)
+
+
+@receiver(post_delete, sender=Product)
+def product_deleted(sender, instance, **kwargs):
+    schedule_suggest_update(instance.pk, None)
+
+
+@receiver((post_save, post_delete), sender=ProductProperty)
+def product_property_changed(sender, instance, **kwargs):
+    touch_products([instance.product_id])
+    schedule_tags_invalidation(
+        get_product_category_ids([instance.product_id]))
+
+
+@receiver(post_save, sender=Property)
+def property_changed(sender, instance, **kwargs):
+    product_ids = instance.products.values_list('product_id', flat=True)
+    touch_products(product_ids)
+    schedule_tags_invalidation(get_product_category_ids(product_ids))
+
+
+# Спрайт пересобирается до сброса версии каталога,
+# чтобы новые снимки категорий ссылались уже на новый файл
+@receiver((post_save, post_delete), sender=Property)
+def property_icon_changed(sender, instance, update_fields=None, **kwargs):
+    if update_fields and 'icon' not in update_fields:
+        return
+    schedule_sprite_rebuild()
+
+
+@receiver(post_save, sender=Promotion)
+@receiver(pre_delete, sender=Promotion)
+def promotion_changed(sender, instance, **kwargs):
+    touch_products(instance.products.values_list('pk', flat=True))
+
+
+@receiver((post_save, post_delete), sender=ProductCategory)
+def product_category_changed(sender, instance, **kwargs):
+    touch_categories([instance.category_id])
+    schedule_tags_invalidation([instance.category_id])
+
+
+@receiver((post_save, post_delete), sender=CategoryBanner)
+def category_banner_changed(sender, instance, **kwargs):
+    touch_categories([instance.category_id])
+
+
+@receiver(post_save, sender=Banner)
+def banner_changed(sender, instance, **kwargs):
+    touch_categories(
+        instance.categories.values_list('category_id', flat=True))
+
+
+# Размер и заглушка относятся к старому файлу,
+# при замене картинки они считаются заново
+def image_replaced(sender, instance, **kwargs):
+    field = IMAGE_FIELDS[sender]
+    file = getattr(instance, field)
+    if not file or not file._committed:
+        for attname in info_fields(field):
+            setattr(instance, attname, None)
+
+
+def image_saved(sender, instance, update_fields=None, **kwargs):
+    field = IMAGE_FIELDS[sender]
+    if update_fields and field not in update_fields:
+        return
+    schedule_image(
+        sender,
+        getattr(instance, field).name,
+        describe=getattr(instance, f'{field}_width') is None,
+    )
+
+
+for model in IMAGE_FIELDS:
+    pre_save.connect(image_replaced, sender=model)
+    post_save.connect(image_saved, sender=model)
+
+
+# Подключается после пересчета метрик, чтобы версия каталога
+# менялась уже после того, как метрики записаны
+def catalog_changed(sender, **kwargs):
+    schedule_catalog_invalidation()
+
+
+for model in CATALOG_MODELS:
+    post_save.connect(catalog_changed, sender=model)
+    post_delete.connect(catalog_changed, sender=model)
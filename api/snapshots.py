@@ -0,0 +1,73 @@
+import time
+from hashlib import md5
+
+from django.core.cache import cache
+from django.db import transaction
+
+from .fastpath import render_category as render_category_fast
+from .models import Category
+from .prefetch import plan_for
+from .renderers import ORJSONRenderer
+from .serializers import CategorySerializer
+
+VERSION_KEY = 'catalog:version'
+# Время последнего изменения каталога для Last-Modified
+MODIFIED_KEY = 'catalog:modified'
+# Снимки старых версий никто не читает, они живут до истечения срока
+SNAPSHOT_TTL = 60 * 60
+
+
+def get_catalog_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        # Если ключ потерялся, начинаем с нового числа,
+        # чтобы не попасть на старые снимки
+        cache.add(VERSION_KEY, time.time_ns(), timeout=None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def get_catalog_modified():
+    modified = cache.get(MODIFIED_KEY)
+    if modified is None:
+        cache.add(MODIFIED_KEY, int(time.time()), timeout=None)
+        modified = cache.get(MODIFIED_KEY)
+    return modified
+
+
+def invalidate_catalog():
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        get_catalog_version()
+    cache.set(MODIFIED_KEY, int(time.time()), timeout=None)
+
+
+def schedule_catalog_invalidation():
+    transaction.on_commit(invalidate_catalog)
+
+
+def render_category(slug):
+    queryset = plan_for(CategorySerializer).apply(Category.objects.all())
+    category = queryset.filter(slug=slug).first()
+    if category is None:
+        return None
+    return ORJSONRenderer().render(render_category_fast(category))
+
+
+def get_category_snapshot(slug):
+    """
+    Готовый JSON категории, хеш его байтов и время сборки или None.
+    Снимок собирается один раз на версию каталога, дальше отдается
+    из кеша без запросов в базу.
+    """
+
+    key = f'category-snapshot:{get_catalog_version()}:{slug}'
+    snapshot = cache.get(key)
+    if snapshot is None:
+        content = render_category(slug)
+        if content is None:
+            return None
+        snapshot = (content, md5(content).hexdigest(), int(time.time()))
+        cache.set(key, snapshot, timeout=SNAPSHOT_TTL)
+    return snapshot
@@ -0,0 +1,105 @@
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+
+from .imaging import build_sprite
+from .models import Property
+
+logger = logging.getLogger(__name__)
+
+SPRITE_KEY = 'property-sprite'
+SPRITE_LOCK_KEY = 'property-sprite:lock'
+SPRITE_NAME = 'sprites/properties.svg'
+# Имя текущего спрайта лежит и в файле, чтобы после потери
+# кеша не пересобирать спрайт
+SPRITE_POINTER = 'sprites/current.txt'
+
+
+def get_symbol_id(pk):
+    return f'property-{pk}'
+
+
+def rebuild_sprite():
+    """
+    Собирает спрайт из иконок всех свойств и запоминает его имя.
+    Хранилище называет файл по хешу содержимого, поэтому у каждой
+    версии спрайта свой адрес и его можно кешировать навсегда.
+    """
+
+    icons = []
+    rows = Property.objects.exclude(icon='').exclude(icon__isnull=True)
+    for pk, name in rows.order_by('pk').values_list('pk', 'icon'):
+        source = default_storage.path(name)
+        if not os.path.exists(source):
+            logger.warning('Нет файла %s, иконка не попадет в спрайт', name)
+            continue
+        icons.append((get_symbol_id(pk), source))
+
+    name = default_storage.save(SPRITE_NAME, ContentFile(build_sprite(icons)))
+    pointer = default_storage.path(SPRITE_POINTER)
+    with open(f'{pointer}.{os.getpid()}.tmp', 'w') as file:
+        file.write(name)
+    os.replace(f'{pointer}.{os.getpid()}.tmp', pointer)
+    cache.set(SPRITE_KEY, name, timeout=None)
+    return name
+
+
+@lru_cache(maxsize=None)
+def get_executor():
+    return ThreadPoolExecutor(max_workers=1)
+
+
+def rebuild_in_background():
+    # Снимки, собранные без спрайта, сбрасываются после сборки.
+    # Импорт здесь: snapshots сам зависит от этого модуля через fastpath
+    from .snapshots import invalidate_catalog
+
+    try:
+        rebuild_sprite()
+        invalidate_catalog()
+    except Exception:
+        logger.exception('Не удалось собрать спрайт свойств')
+    finally:
+        cache.delete(SPRITE_LOCK_KEY)
+        connection.close()
+
+
+def get_sprite_url():
+    """
+    Адрес текущего спрайта или None, если его еще нет. Запрос спрайт
+    не собирает: если нет и файла с именем, сборка идет в фоне.
+    """
+
+    name = cache.get(SPRITE_KEY)
+    if name is None:
+        try:
+            with default_storage.open(SPRITE_POINTER) as file:
+                name = file.read().decode()
+        except FileNotFoundError:
+            if cache.add(SPRITE_LOCK_KEY, 1, timeout=60):
+                get_executor().submit(rebuild_in_background)
+            return None
+        cache.set(SPRITE_KEY, name, timeout=None)
+    return default_storage.url(name)
+
+
+def icon_sprite(prop, sprite_url):
+    """
+    Ссылка на иконку свойства внутри спрайта:
+    '/media/sprites/<хеш>.svg#property-1'. sprite_url берется
+    из get_sprite_url один раз на весь ответ.
+    """
+
+    if not prop.icon or sprite_url is None:
+        return None
+    return f'{sprite_url}#{get_symbol_id(prop.pk)}'
+
+
+def schedule_sprite_rebuild():
+    transaction.on_commit(rebuild_sprite)
@@ -0,0 +1,42 @@
+import hashlib
+import os
+import re
+
+from django.core.files.storage import FileSystemStorage
+
+HASH_LENGTH = 32
+
+# Имя файла или папки вариантов, полученное из хеша содержимого
+HASHED_NAME_RE = re.compile(rf'(^|/)[0-9a-f]{{{HASH_LENGTH}}}(\.\w+)?(/|$)')
+
+
+def is_hashed(name):
+    return HASHED_NAME_RE.search(name) is not None
+
+
+def content_hash(content):
+    digest = hashlib.sha256()
+    content.seek(0)
+    for chunk in content.chunks():
+        digest.update(chunk)
+    content.seek(0)
+    return digest.hexdigest()[:HASH_LENGTH]
+
+
+class ContentHashStorage(FileSystemStorage):
+    """
+    Сохраняет файл под именем из хеша содержимого в папке upload_to:
+    'products/images/pizza.jpg' -> 'products/images/3f9a...c1.jpg'.
+    Одинаковые загрузки хранятся один раз, а файл под таким именем
+    никогда не меняется, поэтому его можно кешировать навсегда.
+    """
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        directory, filename = os.path.split(name)
+        extension = os.path.splitext(filename)[1].lower()
+        name = os.path.join(directory, content_hash(content) + extension)
+        if self.exists(name):
+            return name
+        return super().save(name, content, max_length)
@@ -0,0 +1,307 @@
+import heapq
+import logging
+import re
+import threading
+import time
+from bisect import bisect_left, insort
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.cache import cache
+from django.db import connection, transaction
+
+from .models import Product
+
+logger = logging.getLogger(__name__)
+
+VERSION_KEY = 'suggest:version'
+# Изменения каждой версии лежат в кеше, чтобы другие процессы
+# применили их к своему индексу, не перечитывая все товары
+CHANGES_KEY = 'suggest:changes:{}'
+CHANGES_TTL = 60 * 60
+# Если отстали сильнее, дешевле перестроить индекс целиком
+MAX_CATCH_UP = 500
+
+# Похожесть слов по триграммам, ниже которой слово не считается
+# опечаткой, как pg_trgm.similarity_threshold
+SIMILARITY_THRESHOLD = 0.3
+
+WORD_RE = re.compile(r'\w+')
+
+
+def normalize(text):
+    return ' '.join(WORD_RE.findall(text.lower().replace('ё', 'е')))
+
+
+def trigrams(text):
+    """
+    Триграммы каждого слова с отступами, как в pg_trgm:
+    'пица' -> '  п', ' пи', 'пиц', 'ица', 'ца '.
+    """
+
+    result = set()
+    for word in text.split():
+        word = f'  {word} '
+        result.update(word[i:i + 3] for i in range(len(word) - 2))
+    return result
+
+
+def get_suggest_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        # Новый отсчет не пересекается со старыми номерами, под
+        # которыми в кеше еще могут лежать изменения
+        cache.add(VERSION_KEY, time.time_ns(), timeout=None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+class SuggestIndex:
+    """
+    Индекс названий товаров в памяти процесса: отсортированный
+    словарь слов для поиска по началу слова, триграммы слов для
+    опечаток и для каждого слова отсортированный список товаров.
+    Строится один раз из базы, дальше обновляется по сигналам
+    сохранения и удаления товара. Изменения публикуются в кеше под
+    номером версии, другие процессы догоняют по ним свой индекс.
+    Если изменения уже пропали из кеша, индекс перестраивается в фоне,
+    а запросы пока идут по старому.
+    """
+
+    state = (
+        'names',
+        'words',
+        'keys',
+        'postings',
+        'vocabulary',
+        'grams',
+        'gram_sizes',
+        'version',
+    )
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.version = None
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.rebuilding = False
+        self.clear()
+
+    def clear(self):
+        self.names = {}
+        self.words = {}
+        # Ключ товара (длина названия, pk): короткие названия выше
+        self.keys = {}
+        self.postings = {}
+        self.vocabulary = []
+        self.grams = {}
+        self.gram_sizes = {}
+
+    def load(self, version):
+        self.clear()
+        for pk, name in Product.objects.values_list('pk', 'name'):
+            self.add(pk, name)
+        self.version = version
+
+    def add(self, pk, name):
+        self.remove(pk)
+        text = normalize(name)
+        key = (len(text), pk)
+        self.names[pk] = name
+        self.words[pk] = set(text.split())
+        self.keys[pk] = key
+        for word in self.words[pk]:
+            if word not in self.postings:
+                self.add_word(word)
+            insort(self.postings[word], key)
+
+    def add_word(self, word):
+        self.postings[word] = []
+        insort(self.vocabulary, word)
+        grams = trigrams(word)
+        self.gram_sizes[word] = len(grams)
+        for gram in grams:
+            self.grams.setdefault(gram, set()).add(word)
+
+    def remove(self, pk):
+        if pk not in self.names:
+            return
+        del self.names[pk]
+        key = self.keys.pop(pk)
+        for word in self.words.pop(pk):
+            posting = self.postings[word]
+            del posting[bisect_left(posting, key)]
+            if not posting:
+                self.remove_word(word)
+
+    def remove_word(self, word):
+        del self.postings[word], self.gram_sizes[word]
+        del self.vocabulary[bisect_left(self.vocabulary, word)]
+        for gram in trigrams(word):
+            words = self.grams[gram]
+            words.discard(word)
+            if not words:
+                del self.grams[gram]
+
+    def apply_changes(self, changes):
+        for pk, name in changes:
+            if name is None:
+                self.remove(pk)
+            else:
+                self.add(pk, name)
+
+    def apply(self, changes):
+        """
+        Изменения из этого процесса: применяются сразу и публикуются
+        под новой версией для остальных процессов.
+        """
+
+        with self.lock:
+            if self.version is not None:
+                self.apply_changes(changes)
+            try:
+                version = cache.incr(VERSION_KEY)
+            except ValueError:
+                get_suggest_version()
+                return
+            cache.set(CHANGES_KEY.format(version), changes, CHANGES_TTL)
+            if self.version is not None and version - 1 == self.version:
+                self.version = version
+
+    def catch_up(self, version):
+        """
+        Применяет изменения других процессов. Вызывается под lock.
+        Повторно примененное изменение ничего не портит: add и remove
+        приводят товар к одному и тому же состоянию.
+        """
+
+        if 0 < version - self.version <= MAX_CATCH_UP:
+            keys = [
+                CHANGES_KEY.format(number)
+                for number in range(self.version + 1, version + 1)
+            ]
+            published = cache.get_many(keys)
+            if len(published) == len(keys):
+                for key in keys:
+                    self.apply_changes(published[key])
+                self.version = version
+                return
+        if not self.rebuilding:
+            self.rebuilding = True
+            self.executor.submit(self.rebuild, version)
+
+    def rebuild(self, version):
+        # Новый индекс строится отдельно и подменяет старый целиком
+        try:
+            fresh = SuggestIndex()
+            fresh.load(version)
+            # Изменения новее version применятся потом через catch_up
+            with self.lock:
+                for name in self.state:
+                    setattr(self, name, getattr(fresh, name))
+        except Exception:
+            logger.exception('Не удалось перестроить индекс подсказок')
+        finally:
+            self.rebuilding = False
+            connection.close()
+
+    def match_word(self, query, is_prefix):
+        """
+        Слова словаря, подходящие под слово запроса, с оценкой:
+        точное совпадение 2, начало слова 1.5, опечатка - похожесть
+        по триграммам от SIMILARITY_THRESHOLD до 1.
+        """
+
+        scores = {}
+        grams = trigrams(query)
+        hits = Counter()
+        for gram in grams:
+            hits.update(self.grams.get(gram, ()))
+        for word, count in hits.items():
+            similarity = count / (len(grams) + self.gram_sizes[word] - count)
+            if similarity >= SIMILARITY_THRESHOLD:
+                scores[word] = similarity
+
+        if is_prefix:
+            start = bisect_left(self.vocabulary, query)
+            end = bisect_left(self.vocabulary, query + '\uffff')
+            for word in self.vocabulary[start:end]:
+                scores[word] = 1.5
+
+        if query in self.postings:
+            scores[query] = 2
+        return scores
+
+    def top_for_word(self, scores, limit):
+        # Списки товаров уже отсортированы, поэтому слияние
+        # останавливается на первых limit товарах
+        streams = [
+            ((-score, key) for key in self.postings[word])
+            for word, score in scores.items()
+        ]
+        result = []
+        seen = set()
+        for _, (_, pk) in heapq.merge(*streams):
+            if pk not in seen:
+                seen.add(pk)
+                result.append(pk)
+                if len(result) == limit:
+                    break
+        return result
+
+    def top_for_words(self, matches, limit):
+        # Перебираются товары самого редкого слова запроса,
+        # остальные слова проверяются по словам товара
+        driver = min(matches, key=lambda scores: sum(
+            len(self.postings[word]) for word in scores))
+        candidates = set()
+        for word in driver:
+            candidates.update(key[1] for key in self.postings[word])
+
+        scored = []
+        for pk in candidates:
+            words = self.words[pk]
+            total = 0
+            for scores in matches:
+                best = max((scores.get(word, 0) for word in words))
+                if not best:
+                    break
+                total += best
+            else:
+                scored.append((-total, self.keys[pk]))
+        return [key[1] for _, key in heapq.nsmallest(limit, scored)]
+
+    def suggest(self, query, limit):
+        words = normalize(query).split()
+        if not words:
+            return []
+
+        version = get_suggest_version()
+        with self.lock:
+            if self.version is None:
+                # Без индекса отвечать нечем, первый раз строим сразу
+                self.load(version)
+            elif self.version != version:
+                self.catch_up(version)
+
+            matches = [
+                self.match_word(word, index == len(words) - 1)
+                for index, word in enumerate(words)
+            ]
+            if not all(matches):
+                return []
+            if len(matches) == 1:
+                pks = self.top_for_word(matches[0], limit)
+            else:
+                pks = self.top_for_words(matches, limit)
+            return [{'pk': pk, 'name': self.names[pk]} for pk in pks]
+
+
+suggest_index = SuggestIndex()
+
+
+def schedule_suggest_update(pk, name):
+    """
+    name = None означает, что товар удален.
+    """
+
+    transaction.on_commit(lambda: suggest_index.apply([(pk, name)]))
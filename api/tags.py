@@ -0,0 +1,45 @@
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count
+
+from .models import Property, ProductCategory
+
+# Теги сбрасываются сигналами, срок страхует от записей, которые
+# сигналы пропустили: bulk_create, update() и правки в обход Django
+TAGS_TTL = 60 * 60
+
+
+def get_tags_cache_key(category_id):
+    return f'category-tags:{category_id}'
+
+
+def get_category_tags(category_id):
+    """
+    Свойства товаров категории без повторов и с количеством товаров,
+    одним агрегатным запросом. Результат хранится в кеше.
+    """
+
+    key = get_tags_cache_key(category_id)
+    tags = cache.get(key)
+    if tags is None:
+        tags = list(
+            Property.objects.filter(
+                products__product__categories__category_id=category_id,
+            ).annotate(
+                count=Count('products__product', distinct=True),
+            ).order_by('pk').values('pk', 'name', 'slug', 'count')
+        )
+        cache.set(key, tags, timeout=TAGS_TTL)
+    return tags
+
+
+def schedule_tags_invalidation(category_ids):
+    keys = [get_tags_cache_key(category_id) for category_id in category_ids]
+    if keys:
+        transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def get_product_category_ids(product_ids):
+    return set(ProductCategory.objects.filter(
+        product_id__in=product_ids,
+    ).values_list('category_id', flat=True))
@@ -0,0 +1,1089 @@
+import math
+import os
+import socketserver
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import uuid
+from datetime import date, datetime, time, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from fractions import Fraction
+from importlib import import_module
+from io import StringIO
+from unittest import mock
+
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import connection, connections, transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.translation import gettext_lazy
+from PIL import Image
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from .backends import GuestUser, get_token
+from .codes import CODE_TTL, issue_code, verify_code
+from .models import (
+    Banner,
+    Category,
+    CategoryBanner,
+    City,
+    Collection,
+    Condition,
+    Country,
+    OutgoingEmail,
+    Product,
+    ProductCategory,
+    ProductProperty,
+    ProductSize,
+    Promotion,
+    PromotionCondition,
+    Property,
+    Size,
+)
+from .fastpath import render_category
+from .images import get_formats, image_srcset
+from .imaging import variant_name
+from .mail import MAX_ATTEMPTS, claim_batch, enqueue_email
+from .metrics import METRIC_FIELDS, compute_metrics
+from .prefetch import plan_for
+from .pricing import discount_price, discount_price_expression
+from .renderers import ORJSONRenderer
+from .serializers import CategorySerializer, CodeSerializer
+from .sprites import rebuild_sprite
+from .suggest import (
+    CHANGES_KEY,
+    MAX_CATCH_UP,
+    VERSION_KEY,
+    SuggestIndex,
+    get_suggest_version,
+)
+
+
+def create_catalog(count, prefix='товар'):
+    """
+    Категория pizza с count товарами и наборами из них. Поля
+    заполнены по-разному, чтобы в ответах были и пустые значения.
+    """
+
+    promotion, _ = Promotion.objects.get_or_create(
+        slug='promo',
+        defaults={
+            'title': 'Акция',
+            'description': 'Описание',
+            'image': 'promotions/images/a.jpg',
+            'name': 'Промо',
+            'hex_color': '#fff',
+        },
+    )
+    condition, _ = Condition.objects.get_or_create(name='Условие')
+    PromotionCondition.objects.get_or_create(
+        promotion=promotion, condition=condition)
+    category, _ = Category.objects.get_or_create(
+        slug='pizza',
+        defaults={'name': 'Пицца', 'image': 'categories/images/a.jpg'},
+    )
+    banner, _ = Banner.objects.get_or_create(
+        slug='banner',
+        defaults={'title': 'Баннер', 'image': 'banners/images/b.jpg'},
+    )
+    CategoryBanner.objects.get_or_create(category=category, banner=banner)
+    small, _ = Size.objects.get_or_create(size=4, measurement='шт')
+    big, _ = Size.objects.get_or_create(size=8, measurement='шт')
+    hot, _ = Property.objects.get_or_create(
+        slug='hot',
+        defaults={'name': 'Острое', 'icon': 'properties/images/hot.svg'},
+    )
+    # Свойство без иконки: icon хранится пустой строкой
+    veg, _ = Property.objects.get_or_create(
+        slug='veg', defaults={'name': 'Вег', 'icon': ''})
+
+    products = []
+    for i in range(count):
+        product = Product.objects.create(
+            name=f'{prefix} {i}',
+            description='Описание',
+            discount=10 if i % 2 else None,
+            calorie=100 + i,
+            proteins=5,
+            fats=3,
+            carbohydrates=20,
+            image='products/images/x.jpg' if i % 3 else '',
+            promotion=promotion if i % 2 else None,
+        )
+        ProductSize.objects.create(
+            product=product, size=small, price=333 + i, weight=200)
+        ProductSize.objects.create(
+            product=product, size=big, price=600 + i, weight=400)
+        ProductProperty.objects.create(product=product, property=hot)
+        if i % 2:
+            ProductProperty.objects.create(product=product, property=veg)
+        ProductCategory.objects.create(product=product, category=category)
+        products.append(product)
+
+    for i in range(max(1, count // 3)):
+        combo = Product.objects.create(
+            name=f'{prefix} набор {i}', description=None, discount=15)
+        ProductSize.objects.create(
+            product=combo, size=small, price=999, weight=900)
+        for j, product in enumerate(products[:3]):
+            # Половинки и целые товары вперемешку
+            Collection.objects.create(
+                parent_product=combo, child_product=product,
+                is_full=bool(j % 2))
+        ProductCategory.objects.create(product=combo, category=category)
+
+    country, _ = Country.objects.get_or_create(name='Россия')
+    City.objects.get_or_create(name=f'{prefix} Москва', country=country)
+    return category
+
+
+class FillMetricsMigrationTests(TestCase):
+    """
+    Копия правил в миграции считает то же, что api.metrics.
+    """
+
+    def test_same_as_metrics(self):
+        create_catalog(6)
+        # Набор из набора и товара, размер товара в сантиметрах
+        combo = Product.objects.get(name='товар набор 0')
+        product = Product.objects.get(name='товар 5')
+        outer = Product.objects.create(name='Большой набор')
+        Collection.objects.create(
+            parent_product=outer, child_product=combo, is_full=False)
+        Collection.objects.create(parent_product=outer, child_product=product)
+        centimeters = Size.objects.create(size=30, measurement='см')
+        ProductSize.objects.create(
+            product=product, size=centimeters, price=700, weight=500)
+        ids = list(Product.objects.values_list('pk', flat=True))
+        expected = compute_metrics(ids)
+
+        Product.objects.update(**{field: None for field in METRIC_FIELDS})
+        migration = import_module('api.migrations.0011_fill_product_metrics')
+        migration.fill_product_metrics(apps, None)
+
+        for values in Product.objects.values('pk', *METRIC_FIELDS):
+            with self.subTest(pk=values['pk']):
+                self.assertEqual(values, {'pk': values['pk'],
+                                          **expected[values['pk']]})
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class QueryCountTests(TestCase):
+    """
+    Количество запросов не зависит от числа строк на странице.
+    """
+
+    # Эндпоинт -> запросов на холодном кеше
+    budgets = {
+        '/api/v1/products/': 5,
+        '/api/v1/products/{pk}/': 5,
+        '/api/v1/categories/': 2,
+        '/api/v1/categories/pizza/': 8,
+        '/api/v1/promotions/': 3,
+        '/api/v1/promotions/promo/': 2,
+        '/api/v1/locations/': 3,
+    }
+
+    def setUp(self):
+        # Файл с именем спрайта есть, поэтому холодный кеш
+        # не запускает фоновую сборку
+        rebuild_sprite()
+
+    def assert_budgets(self):
+        client = APIClient()
+        pk = Product.objects.filter(components__isnull=False).first().pk
+        for url, budget in self.budgets.items():
+            url = url.format(pk=pk)
+            cache.clear()
+            with self.subTest(url=url), self.assertNumQueries(budget):
+                response = client.get(url)
+                self.assertEqual(response.status_code, 200)
+
+    def test_small_catalog(self):
+        create_catalog(3)
+        self.assert_budgets()
+
+    def test_large_catalog(self):
+        create_catalog(30)
+        self.assert_budgets()
+
+
+class RendererTests(TestCase):
+    """
+    ORJSONRenderer пишет те же байты, что и JSONRenderer DRF.
+    """
+
+    def test_same_as_drf(self):
+        moscow = dt_timezone(timedelta(hours=3))
+        data = {
+            'price': Decimal('12.50'),
+            'prices': [Decimal('0.1'), Decimal('333'), Decimal('-7.25')],
+            'utc': datetime(2024, 5, 1, 12, 30, 15, 123456, dt_timezone.utc),
+            'local': datetime(2024, 5, 1, 12, 30, tzinfo=moscow),
+            'naive': datetime(2024, 5, 1, 12, 30, 15),
+            'date': date(2024, 5, 1),
+            'time': time(12, 30, 15, 654321),
+            'lazy': gettext_lazy('Товар'),
+            'lazy_list': [gettext_lazy('Пицца'), gettext_lazy('₽')],
+            'uuid': uuid.UUID('12345678-1234-5678-1234-567812345678'),
+            'text': 'Пицца 30см, 555₽',
+            'empty': None,
+            1: True,
+        }
+        for value in data, [data, data]:
+            with self.subTest(value=type(value)):
+                self.assertEqual(
+                    ORJSONRenderer().render(value),
+                    JSONRenderer().render(value),
+                )
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class FastPathTests(TestCase):
+    """
+    Быстрый рендер категории отдает те же байты, что и сериализатор.
+    """
+
+    def setUp(self):
+        rebuild_sprite()
+
+    def render_both(self, slug):
+        queryset = plan_for(CategorySerializer).apply(Category.objects.all())
+        renderer = ORJSONRenderer()
+        fast = renderer.render(render_category(queryset.get(slug=slug)))
+        serialized = renderer.render(
+            CategorySerializer(queryset.get(slug=slug)).data)
+        return fast, serialized
+
+    def test_category(self):
+        create_catalog(6)
+        fast, serialized = self.render_both('pizza')
+        self.assertEqual(fast, serialized)
+        # В каталоге есть все случаи, которые рендерятся по-особому
+        # Половинка набора отдается с припиской 1/2 в названии
+        for fragment in (b'"promotion":null', b' 1/2"',
+                         b'"image":null', b'"icon":null'):
+            with self.subTest(fragment=fragment):
+                self.assertIn(fragment, fast)
+
+    def test_category_without_products(self):
+        Category.objects.create(
+            slug='empty', name='Пусто', image='categories/images/e.jpg')
+        fast, serialized = self.render_both('empty')
+        self.assertEqual(fast, serialized)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class CategorySnapshotTests(TestCase):
+    """
+    Снимок категории проверяется по ETag без запросов в базу.
+    """
+
+    def setUp(self):
+        rebuild_sprite()
+        cache.clear()
+        create_catalog(3)
+        self.client = APIClient()
+
+    def get(self, **headers):
+        return self.client.get('/api/v1/categories/pizza/', **headers)
+
+    def test_warm_snapshot_without_queries(self):
+        etag = self.get()['ETag']
+        with self.assertNumQueries(0):
+            response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['ETag'], etag)
+        with self.assertNumQueries(0):
+            response = self.get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_delete_changes_etag(self):
+        etag = self.get()['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.get(name='товар 0').delete()
+        response = self.get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class KeysetPaginationTests(TestCase):
+    """
+    Курсоры проходят выборку целиком в обе стороны, запрос страницы
+    идет по индексу без OFFSET и COUNT(*).
+    """
+
+    def setUp(self):
+        rebuild_sprite()
+        products = [
+            Product.objects.create(name=f'товар {i}') for i in range(25)]
+        # У части товаров одинаковое время: порядок решает id
+        Product.objects.filter(
+            pk__in=[product.pk for product in products[5:15]],
+        ).update(created_at=timezone.now())
+        for i in range(12):
+            User.objects.create(username=f'user{i}')
+
+    def walk(self, url, link):
+        pages = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            pages.append(response.data)
+            url = response.data[link]
+        return pages
+
+    def assert_round_trip(self, url, key, expected):
+        forward = self.walk(url, 'next')
+        ids = [row[key] for page in forward for row in page['results']]
+        self.assertEqual(ids, expected)
+        self.assertIsNone(forward[0]['previous'])
+
+        backward = self.walk(forward[-1]['previous'], 'previous')
+        self.assertEqual(
+            [page['results'] for page in reversed(backward)],
+            [page['results'] for page in forward[:-1]],
+        )
+
+    def test_products_round_trip(self):
+        expected = list(Product.objects.order_by(
+            '-created_at', '-id').values_list('pk', flat=True))
+        self.assert_round_trip('/api/v1/products/', 'pk', expected)
+
+    def test_users_round_trip(self):
+        expected = list(
+            User.objects.order_by('id').values_list('pk', flat=True))
+        self.assert_round_trip('/api/v1/users/', 'client_id', expected)
+
+    def test_page_query_uses_index(self):
+        next_url = self.client.get('/api/v1/products/').data['next']
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(next_url)
+        sql = [query['sql'] for query in queries]
+        self.assertFalse([query for query in sql if 'COUNT(' in query])
+        self.assertFalse([query for query in sql if 'OFFSET' in query])
+
+        page_sql = next(
+            query for query in sql
+            if query.startswith('SELECT') and 'LIMIT 11' in query)
+        with connection.cursor() as cursor:
+            # На маленькой таблице Postgres выбрал бы полный проход
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            cursor.execute('SET LOCAL enable_bitmapscan = off')
+            cursor.execute(f'EXPLAIN {page_sql}')
+            plan = '\n'.join(row[0] for row in cursor.fetchall())
+        self.assertIn('product_created_at_id_idx', plan)
+        self.assertNotIn('Sort', plan)
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/api/v1/products/', {'cursor': 'x'})
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class ConditionalGetTests(TestCase):
+    """
+    Списки каталога отвечают 304 по версии каталога без запросов.
+    """
+
+    url = '/api/v1/products/'
+
+    def setUp(self):
+        rebuild_sprite()
+        cache.clear()
+        create_catalog(3)
+        self.client = APIClient()
+
+    def test_not_modified_without_queries(self):
+        response = self.client.get(self.url)
+        self.assertTrue(response['Last-Modified'])
+        with self.assertNumQueries(0):
+            response = self.client.get(
+                self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_delete_changes_etag(self):
+        etag = self.client.get(self.url)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.get(name='товар 0').delete()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class FacetTests(TestCase):
+    def setUp(self):
+        rebuild_sprite()
+
+    def get_facets(self, params):
+        response = APIClient().get(
+            '/api/v1/products/', {'facets': 1, **params})
+        self.assertEqual(response.status_code, 200)
+        return response.data['facets']
+
+    def test_count(self):
+        create_catalog(3)
+        self.assertEqual(self.get_facets({'property': 'hot'})['count'], 3)
+
+    def test_nothing_found(self):
+        create_catalog(3)
+        facets = self.get_facets({'price_max': 1})
+        self.assertEqual(facets['count'], 0)
+
+
+class CartQuoteTests(TestCase):
+    """
+    Корзина считается одним запросом цен при любом числе строк,
+    цена со скидкой округляется вверх до рубля.
+    """
+
+    url = '/api/v1/cart/quote/'
+
+    # (цена, скидка) -> цена со скидкой
+    rounding = {
+        (333, 10): 300,
+        (100, 10): 90,
+        (555, 15): 472,
+        (1, 99): 1,
+        (999, 1): 990,
+        (450, None): 450,
+        (450, 0): 450,
+    }
+
+    def setUp(self):
+        create_catalog(20)
+        self.sizes = list(ProductSize.objects.select_related('product'))
+        self.client = APIClient()
+
+    def make_lines(self, count):
+        return [
+            {
+                'product_id': self.sizes[i % len(self.sizes)].product_id,
+                'size_id': self.sizes[i % len(self.sizes)].size_id,
+                'qty': i % 999 + 1,
+            }
+            for i in range(count)
+        ]
+
+    def quote(self, lines):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(
+                self.url, {'lines': lines}, format='json')
+        self.assertEqual(response.status_code, 200)
+        return response.data, len(queries)
+
+    def test_max_lines(self):
+        lines = self.make_lines(1000)
+        missing = {'product_id': 10 ** 6, 'size_id': 1, 'qty': 1}
+        data, count = self.quote([*lines[:-1], missing])
+        _, small_count = self.quote(lines[:1])
+        self.assertEqual(count, small_count)
+        self.assertEqual(count, 1)
+
+        total = 0
+        full_total = 0
+        prices = {(size.product_id, size.size_id): size for size in self.sizes}
+        for line, result in zip(lines, data['lines']):
+            size = prices[line['product_id'], line['size_id']]
+            discount = size.product.discount or 0
+            unit_price = math.ceil(
+                Fraction(size.price * (100 - discount), 100))
+            self.assertEqual(result['discount_price'], unit_price)
+            self.assertEqual(result['total'], unit_price * line['qty'])
+            total += unit_price * line['qty']
+            full_total += size.price * line['qty']
+        self.assertEqual(len(data['lines']), 999)
+        self.assertEqual(data['missing'], [
+            {'product_id': 10 ** 6, 'size_id': 1}])
+        self.assertEqual(data['total'], total)
+        self.assertEqual(data['discount'], full_total - total)
+
+    def test_too_many_lines(self):
+        response = self.client.post(
+            self.url, {'lines': self.make_lines(1001)}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_rounding(self):
+        size = Size.objects.create(size=1, measurement='шт')
+        for (price, discount), expected in self.rounding.items():
+            with self.subTest(price=price, discount=discount):
+                self.assertEqual(discount_price(price, discount), expected)
+                product = Product.objects.create(
+                    name='Округление', discount=discount)
+                ProductSize.objects.create(
+                    product=product, size=size, price=price, weight=1)
+                # SQL считает так же, как Python
+                self.assertEqual(
+                    ProductSize.objects.filter(product=product).values_list(
+                        discount_price_expression(), flat=True).get(),
+                    expected,
+                )
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), MEDIA_ACCEL_REDIRECT='')
+class MediaTests(TestCase):
+    """
+    Django читает медиа с диска только при DEBUG, иначе отдает
+    nginx по X-Accel-Redirect.
+    """
+
+    def setUp(self):
+        self.name = default_storage.save(
+            'products/images/a.jpg', ContentFile(b'jpeg'))
+        self.url = f'/media/{self.name}'
+
+    def test_debug(self):
+        with override_settings(DEBUG=True):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('immutable', response['Cache-Control'])
+
+    def test_production_without_accel_redirect(self):
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+    def test_accel_redirect(self):
+        with override_settings(MEDIA_ACCEL_REDIRECT='/protected/'):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response['X-Accel-Redirect'], f'/protected/{self.name}')
+        self.assertFalse(response.content)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class ImageTests(TestCase):
+    name = 'products/images/srcset.jpg'
+
+    def write_variant(self, width, fmt):
+        path = default_storage.path(variant_name(self.name, width, fmt))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        open(path, 'wb').close()
+
+    def test_only_written_variants(self):
+        product = Product(name='Товар', image=self.name)
+        self.assertIsNone(image_srcset(product.image))
+
+        fmt = get_formats()[0]
+        self.write_variant(320, fmt)
+        self.assertEqual(image_srcset(product.image), {
+            fmt: f'/media/{variant_name(self.name, 320, fmt)} 320w'})
+
+        for width in settings.IMAGE_VARIANT_WIDTHS:
+            for fmt in get_formats():
+                self.write_variant(width, fmt)
+        srcset = image_srcset(product.image)
+        self.assertEqual(set(srcset), set(get_formats()))
+        self.assertEqual(
+            srcset[fmt].count('w,'), len(settings.IMAGE_VARIANT_WIDTHS) - 1)
+
+    def test_process_media_with_partly_described_image(self):
+        # Одна картинка в двух строках: размер есть только у одной
+        path = default_storage.path('products/images/shared.jpg')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        Image.new('RGB', (40, 30)).save(path)
+        Product.objects.create(
+            name='С размером', image='products/images/shared.jpg',
+            image_width=40, image_height=30)
+        product = Product.objects.create(
+            name='Без размера', image='products/images/shared.jpg')
+
+        call_command(
+            'process_media', workers=1, stdout=StringIO(), stderr=StringIO())
+        product.refresh_from_db()
+        self.assertEqual((product.image_width, product.image_height), (40, 30))
+
+
+User = get_user_model()
+
+
+class CheckCodeTests(TestCase):
+    """
+    Подтверждение почты, которая уже есть у другого пользователя.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.target = User.objects.create(
+            email='found@example.com', is_verified=True)
+        self.group = Group.objects.create(name='Группа')
+
+    def confirm(self, user):
+        token = get_token(user).access_token
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        client.post(
+            '/api/v1/users/send-code/', {'email': self.target.email})
+        code = OutgoingEmail.objects.latest('pk').subject.rsplit(' ', 1)[1]
+        response = client.post('/api/v1/users/check-code/', {'code': code})
+        self.assertEqual(response.status_code, 201)
+        me = APIClient()
+        me.credentials(HTTP_AUTHORIZATION=f'Bearer {response.data["access"]}')
+        return me.get('/api/v1/users/me/').data['client_id']
+
+    def test_anonymous_user_is_merged(self):
+        guest = GuestUser()
+        source = User.objects.create(guest_id=guest.guest_id)
+        source.groups.add(self.group)
+
+        self.assertEqual(self.confirm(guest), self.target.pk)
+        self.assertFalse(User.objects.filter(pk=source.pk).exists())
+        self.assertTrue(self.target.groups.filter(pk=self.group.pk).exists())
+
+    def test_user_with_password_is_kept(self):
+        source = User.objects.create_user(
+            username='owner', password='Qwerty12345!')
+        source.groups.add(self.group)
+
+        self.assertEqual(self.confirm(source), self.target.pk)
+        self.assertTrue(source.groups.filter(pk=self.group.pk).exists())
+        self.assertFalse(self.target.groups.exists())
+
+    def test_non_ascii_digits(self):
+        client = APIClient()
+        access = client.get('/api/v1/users/me/').data['access']
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {access}')
+        client.post('/api/v1/users/send-code/', {'email': 'a@example.com'})
+        for code in ('١٢٣٤٥', '１２３４５', '12a45', ''):
+            with self.subTest(code=code):
+                serializer = CodeSerializer(data={'code': code})
+                self.assertFalse(serializer.is_valid())
+                response = client.post(
+                    '/api/v1/users/check-code/', {'code': code})
+                self.assertEqual(response.status_code, 400)
+        # Мимо сериализатора строка не ASCII тоже не дает ошибки
+        guest = GuestUser()
+        issue_code(guest, 'a@example.com')
+        self.assertIsNone(verify_code(guest, '١٢٣٤٥'))
+
+    def test_merge_refuses_user_with_email(self):
+        source = User.objects.create(email='own@example.com')
+        with self.assertRaises(ValueError):
+            User.objects.merge(source, self.target)
+        self.assertTrue(User.objects.filter(pk=source.pk).exists())
+
+
+class SuggestIndexTests(TestCase):
+    """
+    Индекс другого процесса догоняет изменения по кешу без
+    перечитывания товаров.
+    """
+
+    def setUp(self):
+        cache.clear()
+        Product.objects.create(name='Пицца пепперони')
+        # Индексы двух процессов
+        self.writer = SuggestIndex()
+        self.reader = SuggestIndex()
+        for index in (self.writer, self.reader):
+            index.suggest('пицца', 10)
+
+    def names(self, index, query):
+        return [row['name'] for row in index.suggest(query, 10)]
+
+    def test_catch_up(self):
+        product = Product.objects.create(name='Ролл Калифорния')
+        self.writer.apply([(product.pk, product.name)])
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                self.names(self.reader, 'ролл'), ['Ролл Калифорния'])
+        self.assertEqual(self.reader.version, get_suggest_version())
+
+    def test_rebuild_when_changes_expired(self):
+        product = Product.objects.create(name='Ролл Калифорния')
+        self.writer.apply([(product.pk, product.name)])
+        cache.delete(CHANGES_KEY.format(get_suggest_version()))
+        with mock.patch.object(self.reader.executor, 'submit') as submit:
+            # Пока индекс строится в фоне, ответ идет по старому
+            with self.assertNumQueries(0):
+                self.assertEqual(self.names(self.reader, 'ролл'), [])
+            self.names(self.reader, 'ролл')
+        submit.assert_called_once()
+
+    def test_catch_up_delete(self):
+        product = Product.objects.get(name='Пицца пепперони')
+        self.writer.apply([(product.pk, None)])
+        with self.assertNumQueries(0):
+            self.assertEqual(self.names(self.reader, 'пицца'), [])
+
+    def test_rebuild_when_too_far_behind(self):
+        cache.incr(VERSION_KEY, MAX_CATCH_UP + 1)
+        with mock.patch.object(self.reader.executor, 'submit') as submit:
+            with mock.patch.object(cache, 'get_many') as get_many:
+                self.names(self.reader, 'пицца')
+        # Изменения не читаются, индекс сразу перестраивается
+        get_many.assert_not_called()
+        submit.assert_called_once()
+
+
+class SuggestRebuildTests(TransactionTestCase):
+    """
+    Перестройка индекса в фоновом потоке со своим соединением.
+    """
+
+    def setUp(self):
+        cache.clear()
+        Product.objects.create(name='Пицца пепперони')
+        self.index = SuggestIndex()
+        self.index.suggest('пицца', 10)
+
+    def names(self, query):
+        return [row['name'] for row in self.index.suggest(query, 10)]
+
+    def test_rebuild_when_changes_expired(self):
+        # Товар сохранен в другом процессе, его изменения пропали
+        Product.objects.create(name='Ролл Калифорния')
+        version = get_suggest_version()
+        cache.delete(CHANGES_KEY.format(version))
+
+        # Пока индекс строится, ответ идет по старому
+        self.assertEqual(self.names('ролл'), [])
+        self.index.executor.shutdown(wait=True)
+
+        self.assertFalse(self.index.rebuilding)
+        self.assertEqual(self.index.version, version)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.names('ролл'), ['Ролл Калифорния'])
+            self.assertEqual(self.names('пицца'), ['Пицца пепперони'])
+
+
+class LastActivityMigrationTests(TransactionTestCase):
+    """
+    Существующим пользователям last_activity берется из last_login,
+    а не ставится временем миграции.
+    """
+
+    before = ('users_app', '0009_customuser_guest_id')
+    after = ('users_app', '0010_customuser_last_activity')
+
+    def migrate(self, target):
+        executor = MigrationExecutor(connection)
+        executor.migrate([target])
+        return executor.loader.project_state([target]).apps
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def test_fill_from_last_login(self):
+        old_apps = self.migrate(self.before)
+        OldUser = old_apps.get_model('users_app', 'CustomUser')
+        last_login = timezone.now() - timedelta(days=3)
+        OldUser.objects.create(username='active', last_login=last_login)
+        OldUser.objects.create(username='guest')
+
+        new_apps = self.migrate(self.after)
+        NewUser = new_apps.get_model('users_app', 'CustomUser')
+        migration = import_module(
+            'users_app.migrations.0010_customuser_last_activity')
+        self.assertEqual(
+            dict(NewUser.objects.values_list('username', 'last_activity')),
+            {
+                'active': last_login,
+                'guest': migration.UNKNOWN_ACTIVITY,
+            },
+        )
+        # Новые строки по-прежнему получают текущее время
+        self.assertAlmostEqual(
+            User.objects.create(username='new').last_activity,
+            timezone.now(),
+            delta=timedelta(minutes=1),
+        )
+
+
+class CollectionCycleTests(TransactionTestCase):
+    """
+    Встречные наборы из разных транзакций не замыкают кольцо.
+    """
+
+    def setUp(self):
+        self.first = Product.objects.create(name='Набор 1')
+        self.second = Product.objects.create(name='Набор 2')
+        self.saved = threading.Event()
+        self.release = threading.Event()
+
+    def hold(self, parent, child):
+        try:
+            with transaction.atomic():
+                Collection.objects.create(
+                    parent_product=parent, child_product=child)
+                self.saved.set()
+                self.release.wait(5)
+        finally:
+            connections.close_all()
+
+    def add(self, parent, child):
+        try:
+            Collection.objects.create(
+                parent_product=parent, child_product=child)
+        finally:
+            connections.close_all()
+
+    def test_concurrent_reverse_sets(self):
+        with ThreadPoolExecutor(2) as pool:
+            holder = pool.submit(self.hold, self.first, self.second)
+            self.assertTrue(self.saved.wait(5))
+            reverse = pool.submit(self.add, self.second, self.first)
+            # Проверка ждет конца первой транзакции и видит ее набор
+            with self.assertRaises(TimeoutError):
+                reverse.result(timeout=0.3)
+            self.release.set()
+            holder.result()
+            with self.assertRaises(ValidationError):
+                reverse.result()
+        self.assertEqual(
+            list(Collection.objects.values_list(
+                'parent_product', 'child_product')),
+            [(self.first.pk, self.second.pk)],
+        )
+
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+    """
+    Почтовый сервер для тестов: принимает письма без авторизации
+    и отвечает 451 на первые server.fail писем.
+    """
+
+    def reply(self, line):
+        self.wfile.write(f'{line}\r\n'.encode())
+
+    def handle(self):
+        self.server.connections += 1
+        self.reply('220 localhost')
+        for line in self.rfile:
+            command = line[:4].upper()
+            if command == b'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                data = b''.join(iter(self.rfile.readline, b'.\r\n'))
+                if self.server.fail:
+                    self.server.fail -= 1
+                    self.reply('451 Try later')
+                else:
+                    self.server.messages.append(data)
+                    self.reply('250 OK')
+            elif command == b'QUIT':
+                self.reply('221 Bye')
+                break
+            else:
+                self.reply('250 OK')
+
+
+class SMTPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), SMTPHandler)
+        self.connections = 0
+        self.fail = 0
+        self.messages = []
+
+
+class MailTests(TransactionTestCase):
+    """
+    run_mail_worker против настоящего SMTP соединения.
+    """
+
+    def setUp(self):
+        self.server = SMTPServer()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        email_settings = override_settings(
+            EMAIL_BACKEND='django.core.mail.backends.smtp.EmailBackend',
+            EMAIL_HOST='127.0.0.1',
+            EMAIL_PORT=self.server.server_address[1],
+            EMAIL_USE_SSL=False,
+            EMAIL_USE_TLS=False,
+            EMAIL_HOST_USER='',
+            EMAIL_HOST_PASSWORD='',
+        )
+        email_settings.enable()
+        self.addCleanup(email_settings.disable)
+
+    def run_worker(self):
+        call_command('run_mail_worker', '--once', stdout=StringIO())
+
+    def test_one_connection_and_retry(self):
+        for i in range(5):
+            enqueue_email(f'user{i}@example.com', 'Тема', html_body='<b>1</b>')
+        self.server.fail = 1
+
+        self.run_worker()
+        self.assertEqual(len(self.server.messages), 4)
+        self.assertEqual(self.server.connections, 1)
+        failed = OutgoingEmail.objects.get(sent_at__isnull=True)
+        self.assertEqual(failed.attempts, 1)
+        self.assertIn('451', failed.last_error)
+        self.assertGreater(failed.send_after, timezone.now())
+        self.assertIsNone(failed.locked_until)
+
+        OutgoingEmail.objects.update(send_after=timezone.now())
+        self.run_worker()
+        self.assertEqual(len(self.server.messages), 5)
+        self.assertIn(b'Content-Type: text/html', self.server.messages[0])
+
+    def test_send_outside_transaction(self):
+        enqueue_email('user@example.com', 'Тема', body='Текст')
+        sent = []
+
+        def send_message(message, mail_connection):
+            # Строка уже занята воркером, но не заблокирована транзакцией
+            self.assertFalse(connection.in_atomic_block)
+            self.assertIsNotNone(OutgoingEmail.objects.get().locked_until)
+            sent.append(message)
+
+        with mock.patch('api.mail.send_message', send_message):
+            self.run_worker()
+        self.assertEqual(len(sent), 1)
+        self.assertIsNotNone(OutgoingEmail.objects.get().sent_at)
+
+    def test_claimed_emails_are_skipped(self):
+        enqueue_email('user@example.com', 'Тема', body='Текст')
+        emails, _ = claim_batch(10)
+        self.assertEqual(len(emails), 1)
+        self.assertEqual(claim_batch(10)[0], [])
+
+        # Воркер упал: после срока письмо забирает другой
+        OutgoingEmail.objects.update(
+            locked_until=timezone.now() - timedelta(seconds=1))
+        self.run_worker()
+        self.assertEqual(len(self.server.messages), 1)
+
+    def test_expired_email_is_not_sent(self):
+        enqueue_email(
+            'user@example.com', 'Тема', body='Текст',
+            expires_at=timezone.now() - timedelta(seconds=1))
+        self.run_worker()
+        self.assertEqual(self.server.messages, [])
+        # Письмо вышло из очереди, а не осталось в ней навсегда
+        self.assertIsNotNone(OutgoingEmail.objects.get().failed_at)
+
+    def test_last_attempt_fails_email(self):
+        email = enqueue_email('user@example.com', 'Тема', body='Текст')
+        OutgoingEmail.objects.update(attempts=MAX_ATTEMPTS - 1)
+        self.server.fail = 1
+        self.run_worker()
+
+        email.refresh_from_db()
+        self.assertEqual(email.attempts, MAX_ATTEMPTS)
+        self.assertIsNotNone(email.failed_at)
+        self.assertIsNone(email.sent_at)
+        OutgoingEmail.objects.update(send_after=timezone.now())
+        self.assertEqual(claim_batch(10)[0], [])
+
+    def test_migration_fails_dead_emails(self):
+        enqueue_email('live@example.com', 'Тема')
+        enqueue_email('old@example.com', 'Тема', expires_at=timezone.now())
+        tried = enqueue_email('tried@example.com', 'Тема')
+        OutgoingEmail.objects.filter(pk=tried.pk).update(
+            attempts=MAX_ATTEMPTS)
+
+        migration = import_module(
+            'api.migrations.0014_outgoingemail_failed_at')
+        migration.fail_dead_emails(apps, None)
+        self.assertEqual(
+            set(OutgoingEmail.objects.filter(
+                failed_at__isnull=False).values_list('to', flat=True)),
+            {'old@example.com', 'tried@example.com'},
+        )
+
+
+class VerificationCodeTests(TransactionTestCase):
+    """
+    Параллельные send-code и check-code гостей. Код живет в кеше,
+    поэтому строки пользователей не обновляются: на каждого гостя
+    один INSERT готовой строки после подтверждения.
+    """
+
+    cycles = 40
+    threads = 8
+
+    def setUp(self):
+        cache.clear()
+        self.lock = threading.Lock()
+        self.writes = {'INSERT': 0, 'UPDATE': 0}
+
+    def count_writes(self, execute, sql, params, many, context):
+        statement = sql.split(' WHERE ')[0]
+        if '"users_app_customuser"' in statement:
+            with self.lock:
+                for command in self.writes:
+                    if sql.startswith(command):
+                        self.writes[command] += 1
+        return execute(sql, params, many, context)
+
+    def confirm_email(self, number):
+        email = f'guest{number}@example.com'
+        client = APIClient()
+        try:
+            with connection.execute_wrapper(self.count_writes):
+                access = client.get('/api/v1/users/me/').data['access']
+                client.credentials(HTTP_AUTHORIZATION=f'Bearer {access}')
+                response = client.post(
+                    '/api/v1/users/send-code/', {'email': email})
+                self.assertEqual(response.status_code, 201)
+                mail = OutgoingEmail.objects.get(to=email)
+                code = mail.subject.rsplit(' ', 1)[1]
+                response = client.post(
+                    '/api/v1/users/check-code/', {'code': code})
+                self.assertEqual(response.status_code, 201)
+            return code, mail
+        finally:
+            connections.close_all()
+
+    def check_code(self, access, code, barrier):
+        def compare_digest(a, b):
+            # Оба запроса прочитали код до того, как один его удалил
+            barrier.wait()
+            return a == b
+
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {access}')
+        try:
+            with mock.patch('api.codes.secrets.compare_digest',
+                            compare_digest):
+                return client.post(
+                    '/api/v1/users/check-code/', {'code': code}).status_code
+        finally:
+            connections.close_all()
+
+    def test_same_code_twice(self):
+        client = APIClient()
+        access = client.get('/api/v1/users/me/').data['access']
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {access}')
+        client.post('/api/v1/users/send-code/', {'email': 'a@example.com'})
+        code = OutgoingEmail.objects.get().subject.rsplit(' ', 1)[1]
+
+        barrier = threading.Barrier(2, timeout=5)
+        with ThreadPoolExecutor(2) as pool:
+            statuses = list(pool.map(
+                lambda _: self.check_code(access, code, barrier), range(2)))
+        self.assertEqual(sorted(statuses), [201, 400])
+        self.assertEqual(User.objects.filter(is_verified=True).count(), 1)
+
+    def test_concurrent_guests(self):
+        with ThreadPoolExecutor(self.threads) as pool:
+            results = list(pool.map(self.confirm_email, range(self.cycles)))
+
+        self.assertEqual(self.writes, {'INSERT': self.cycles, 'UPDATE': 0})
+        self.assertEqual(
+            User.objects.filter(is_verified=True).count(), self.cycles)
+        for code, mail in results:
+            self.assertRegex(code, r'^\d{5}$')
+            self.assertAlmostEqual(
+                mail.expires_at - mail.created_at,
+                timedelta(seconds=CODE_TTL),
+                delta=timedelta(seconds=5),
+            )
@@ -1,6 +1,4 @@
-from django.conf import settings
 from django.urls import path, include
-from django.conf.urls.static import static
 from rest_framework.routers import DefaultRouter
 
 from .views import (
@@ -9,6 +7,7 @@ from .views import (
     UserViewSet,
     PromotionViewSet,
     CategoryViewSet,
+    CartViewSet,
 )
 
 router = DefaultRouter()
@@ -18,10 +17,9 @@ router.register('products', ProductViewSet)
 router.register('categories', CategoryViewSet)
 router.register('promotions', PromotionViewSet)
 router.register('locations', LocationViewSet)
+router.register('cart', CartViewSet, basename='cart')
 
 app_name = 'app'
 urlpatterns = [
     path('', include(router.urls)),
 ]
-
-urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
@@ -1,15 +1,32 @@
-from random import randint
-from smtplib import SMTPDataError
+from datetime import timedelta
 
-from django.core.mail import EmailMultiAlternatives
+from django.db.models import Q
 from django.shortcuts import get_object_or_404
 from django.template.loader import render_to_string
+from django.utils import timezone
+from django_filters import utils
+from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import viewsets, permissions, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 from rest_framework_simplejwt import tokens
 
+from .backends import GuestUser, get_persisted_user, persist_user
+from .codes import CODE_TTL, issue_code, verify_code
+from .filters import ProductFilter, is_filtering
+from .mail import enqueue_email
+from .mixins import (
+    PrefetchPlanMixin,
+    ConditionalGetMixin,
+    CategorySnapshotMixin,
+    FacetMixin,
+)
 from .models import Product, User, Country, Promotion, Category
+from .pagination import ProductPagination, UserPagination
+from .pricing import quote_cart
+from .search import search_products
+from .suggest import suggest_index
 from .serializers import (
     ProductSerializer,
     LocationSerializer,
@@ -19,39 +36,164 @@ from .serializers import (
     CodeSerializer,
     EmailLoginSerializer,
     PromotionSerializer,
+    ProductIdsSerializer,
+    CartQuoteSerializer,
     CategorySerializer,
     UserMeSerializer, ShortCategorySerializer,
 )
 
 
-class ProductViewSet(viewsets.ReadOnlyModelViewSet):
+class ProductViewSet(
+    ConditionalGetMixin,
+    FacetMixin,
+    PrefetchPlanMixin,
+    viewsets.ReadOnlyModelViewSet,
+):
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
+    pagination_class = ProductPagination
+    filter_backends = [DjangoFilterBackend]
+    filterset_class = ProductFilter
+    search_limit = 20
+    suggest_limit = 10
+    max_search_limit = 100
+
+    def get_facet_queryset(self):
+        return Product.objects.all()
+
+    def get_limit(self, request, default):
+        try:
+            limit = int(request.query_params.get('limit', default))
+        except ValueError:
+            return default
+        return min(max(limit, 1), self.max_search_limit)
+
+    @action(methods=['GET'], detail=False)
+    def search(self, request):
+        """
+        products_search\n
+        Полнотекстовый поиск по названию и описанию товара.\n
+        Получает строку поиска в параметре name и необязательный limit.\n
+        Возвращает товары по убыванию релевантности.\n
+        """
+
+        query = request.query_params.get(api_settings.SEARCH_PARAM, '')
+        if not query.strip():
+            return Response({'message': 'Параметр name обязательный!'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        queryset = search_products(self.get_queryset(), query)
+        queryset = queryset[:self.get_limit(request, self.search_limit)]
+        serializer = self.get_serializer(queryset, many=True)
+        return Response(serializer.data)
+
+    @action(methods=['GET', 'POST'], detail=False)
+    def batch(self, request):
+        """
+        products_batch\n
+        Несколько товаров за один запрос, например для корзины.\n
+        Получает ids: в GET через запятую (?ids=1,2,3),
+        в POST списком в теле запроса.\n
+        Возвращает товары в порядке ids и список ненайденных ids.\n
+        """
+
+        if request.method == 'GET':
+            ids = request.query_params.get('ids', '')
+            data = {'ids': [pk for pk in ids.split(',') if pk.strip()]}
+        else:
+            data = request.data
+        serializer = ProductIdsSerializer(data=data)
+        serializer.is_valid(raise_exception=True)
+        ids = list(dict.fromkeys(serializer.validated_data['ids']))
+
+        products = {
+            product.pk: product
+            for product in self.get_queryset().filter(pk__in=ids)
+        }
+        serializer = self.get_serializer(
+            [products[pk] for pk in ids if pk in products], many=True)
+        return Response({
+            'results': serializer.data,
+            'missing': [pk for pk in ids if pk not in products],
+        })
+
+    @action(methods=['GET'], detail=False)
+    def suggest(self, request):
+        """
+        products_suggest\n
+        Подсказки названий товаров по началу слова или с опечаткой.\n
+        Получает строку в параметре name и необязательный limit.\n
+        Возвращает список pk и name без запросов в базу.\n
+        """
+
+        query = request.query_params.get(api_settings.SEARCH_PARAM, '')
+        limit = self.get_limit(request, self.suggest_limit)
+        return Response(suggest_index.suggest(query, limit))
 
 
-class CategoryViewSet(viewsets.ReadOnlyModelViewSet):
+class CategoryViewSet(
+    CategorySnapshotMixin,
+    ConditionalGetMixin,
+    FacetMixin,
+    PrefetchPlanMixin,
+    viewsets.ReadOnlyModelViewSet,
+):
     queryset = Category.objects.all()
     lookup_field = 'slug'
+    facet_actions = ('retrieve',)
 
     def get_serializer_class(self):
         if self.action == 'list':
             return ShortCategorySerializer
         return CategorySerializer
 
+    def get_facet_queryset(self):
+        return Product.objects.filter(
+            categories__category__slug=self.kwargs[self.lookup_field])
+
+    def get_prefetch_filters(self):
+        # Фильтры товаров применяются к товарам внутри категории
+        params = self.request.query_params
+        if self.action != 'retrieve' or not is_filtering(params):
+            return None
+        filterset = ProductFilter(params, queryset=Product.objects.all())
+        if not filterset.is_valid():
+            raise utils.translate_validation(filterset.errors)
+        return {'products': Q(product__in=filterset.qs.values('pk'))}
+
+
+class CartViewSet(viewsets.GenericViewSet):
+    serializer_class = CartQuoteSerializer
+
+    @action(methods=['POST'], detail=False)
+    def quote(self, request):
+        """
+        cart_quote\n
+        Расчет корзины.\n
+        Получает lines: список product_id, size_id и qty.\n
+        Возвращает цены и суммы по строкам, общую сумму и скидку,
+        а в missing - строки с несуществующим размером товара.\n
+        """
+
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return Response(quote_cart(serializer.validated_data['lines']))
+
 
-class PromotionViewSet(viewsets.ReadOnlyModelViewSet):
+class PromotionViewSet(PrefetchPlanMixin, viewsets.ReadOnlyModelViewSet):
     queryset = Promotion.objects.all()
     serializer_class = PromotionSerializer
     lookup_field = 'slug'
 
 
-class LocationViewSet(viewsets.ReadOnlyModelViewSet):
+class LocationViewSet(PrefetchPlanMixin, viewsets.ReadOnlyModelViewSet):
     queryset = Country.objects.all()
     serializer_class = LocationSerializer
 
 
 class UserViewSet(viewsets.ModelViewSet):
     queryset = User.objects.all()
+    pagination_class = UserPagination
 
     def get_serializer_class(self):
         if self.action == 'set_password':
@@ -74,15 +216,17 @@ class UserViewSet(viewsets.ModelViewSet):
         """
         users_me\n
         Возвращает информацию о пользователе, если аноним,
-        создается новый пользователь и токен.\n
+        выдается гостевой токен. Строка пользователя в базе
+        создается позже, когда гостю нужно что-то сохранить.\n
         Возвращает просто статус кода 200.\n
         """
 
         user = request.user
 
         if user.is_anonymous:
-            user = User()
-            user.save()
+            user = GuestUser()
+        else:
+            user = get_persisted_user(user) or user
 
         serializer = self.get_serializer(user, context={'user': user})
 
@@ -103,9 +247,9 @@ class UserViewSet(viewsets.ModelViewSet):
 
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
-        user = request.user
+        user = persist_user(request.user)
         user.set_password(serializer.validated_data.get('password'))
-        user.save()
+        user.save(update_fields=['password'])
         return Response(status=status.HTTP_201_CREATED)
 
     @action(
@@ -125,30 +269,24 @@ class UserViewSet(viewsets.ModelViewSet):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         email = serializer.validated_data.get('email')
-        code = ''.join([str(randint(0, 9)) for _ in range(5)])
 
         if not email:
             return Response({'message': 'Поле email обязательное!'},
                             status=status.HTTP_400_BAD_REQUEST)
 
-        request.user.email = email
-        request.user.code = code
-        request.user.save()
-
+        # Код и почта хранятся в кеше, строка пользователя не меняется
+        code = issue_code(request.user, email)
         html_body = render_to_string(
             'email_templates/confirm_verification_email.html',
             {'code': code},
         )
-        msg = EmailMultiAlternatives(
-            subject=f'Код подтверждения - {code}',
-            to=[email]
+        # Письмо отправит run_mail_worker, но не позже, чем истечет код
+        enqueue_email(
+            email,
+            f'Код подтверждения - {code}',
+            html_body=html_body,
+            expires_at=timezone.now() + timedelta(seconds=CODE_TTL),
         )
-        msg.attach_alternative(html_body, 'text/html')
-
-        try:
-            msg.send()
-        except SMTPDataError:
-            return Response(status=status.HTTP_429_TOO_MANY_REQUESTS)
 
         return Response(status=status.HTTP_201_CREATED)
 
@@ -166,29 +304,47 @@ class UserViewSet(viewsets.ModelViewSet):
         Если код совпадает, то меняем статус текущего пользователя
         на верифицированного и возвращается его токен,
         либо если уже существует пользователь,
-        просто получаем его, и отдаем его токен.\n
+        переносим к нему данные текущего анонимного, удаляем текущего
+        и отдаем токен найденного.\n
         Получает password и re_password.\n
         Возвращает просто статус кода 201, если пароли проходят валидацию.\n
         """
 
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
-        code = serializer.validated_data.get('code')
+        email = verify_code(
+            request.user, serializer.validated_data.get('code'))
 
-        if request.user.code != code:
+        if email is None:
             return Response(
                 {'message': 'Код не совпадает с отправленным на почту'},
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        user = User.objects.filter(
-            email=request.user.email, is_verified=True
-        ).first()
-        if not user:
-            user = request.user
-
-        user.is_verified = True
-        user.save()
+        current_user = get_persisted_user(request.user)
+        user = User.objects.filter(email=email, is_verified=True).first()
+        if user is None and current_user is None:
+            # Гость сразу получает готовую строку
+            user = User.objects.create(
+                guest_id=request.user.guest_id,
+                email=email,
+                is_verified=True,
+            )
+        elif user is None:
+            user = current_user
+            user.email = email
+            user.is_verified = True
+            user.save(update_fields=['email', 'is_verified'])
+        elif (current_user is not None and user.pk != current_user.pk
+                and current_user.is_anonymous_account):
+            # Данные анонимного пользователя переходят к найденному.
+            # Пользователь со своими почтой или паролем остается как
+            # есть, выдаются только токены найденного
+            try:
+                User.objects.merge(current_user, user)
+            except ValueError:
+                # Пока шел запрос, текущий перестал быть анонимным
+                pass
 
         refresh = tokens.RefreshToken.for_user(user)
         content = {
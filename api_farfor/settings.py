@@ -41,6 +41,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'drf_yasg',
     'corsheaders',
     'django_filters',
@@ -95,6 +96,22 @@ DATABASES = {
     }
 }
 
+# Кеш: снимки меню, версия каталога и коды подтверждения. Для нескольких
+# процессов нужен общий бэкенд, например
+# django.core.cache.backends.redis.RedisCache
+CACHES = {
+    'default': {
+        'BACKEND': env.str(
+            'CACHE_BACKEND',
+            'django.core.cache.backends.locmem.LocMemCache',
+        ),
+        'LOCATION': env.str('CACHE_LOCATION', ''),
+    }
+}
+
+# Для одного процесса LocMemCache хватает: api.W001 можно отключить
+SILENCED_SYSTEM_CHECKS = env.list('SILENCED_SYSTEM_CHECKS', [])
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -142,13 +159,22 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.AllowAny',
     ],
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'api.backends.GuestJWTAuthentication',
+    ],
+    'DEFAULT_RENDERER_CLASSES': [
+        'api.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
     ],
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 10,
     'SEARCH_PARAM': 'name',
 }
 
+# Проверка prefetch плана: запросы из SerializerMethodField
+# пишутся в лог, а в строгом режиме вызывают ошибку
+PREFETCH_GUARD = DEBUG
+PREFETCH_GUARD_STRICT = False
+
 # Настройки JWT
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(hours=3),
@@ -160,6 +186,25 @@ SIMPLE_JWT = {
 MEDIA_URL = '/media/'
 MEDIA_ROOT = Path(BASE_DIR, 'media')
 
+# Файлы хранятся под хешем содержимого, см. api.storage
+STORAGES = {
+    'default': {
+        'BACKEND': 'api.storage.ContentHashStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+    },
+}
+
+# Префикс internal location в nginx, например /protected-media/.
+# Если задан, медиа отдает nginx по заголовку X-Accel-Redirect
+MEDIA_ACCEL_REDIRECT = env.str('MEDIA_ACCEL_REDIRECT', '')
+
+# Варианты картинок для srcset, см. api.images
+IMAGE_VARIANT_WIDTHS = (320, 640, 1280)
+IMAGE_VARIANT_FORMATS = ('avif', 'webp', 'jpeg')
+IMAGE_WORKERS = env.int('IMAGE_WORKERS', 2)
+
 # Настройки CORS
 CORS_URLS_REGEX = r'^/api/.*$'
 CORS_ALLOWED_ORIGINS = [
@@ -20,9 +20,12 @@ from rest_framework import permissions
 from drf_yasg.views import get_schema_view
 from drf_yasg import openapi
 
+from api.media import serve_media
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/v1/', include('api.urls', namespace='api')),
+    re_path(r'^media/(?P<path>.+)$', serve_media),
 ]
 
 schema_view = get_schema_view(
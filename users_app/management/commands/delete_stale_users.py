@@ -0,0 +1,83 @@
+import time
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from django.utils import timezone
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = ('Удаляет анонимных пользователей без почты и пароля, '
+            'которые давно не заходили. Удаляет небольшими пачками '
+            'с паузами, чтобы не держать долгих блокировок. Прерванный '
+            'запуск можно просто повторить: удаленные строки уже '
+            'выпали из индекса, и выборка продолжится с оставшихся.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=30,
+            help='Сколько дней без активности считать давним',
+        )
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument(
+            '--sleep',
+            type=float,
+            default=0.5,
+            help='Пауза между пачками в секундах',
+        )
+        parser.add_argument(
+            '--max-batches',
+            type=int,
+            default=0,
+            help='Остановиться после стольких пачек, 0 - без ограничения',
+        )
+
+    def handle(self, *args, **options):
+        stale = User.objects.stale_anonymous(
+            timezone.now() - timedelta(days=options['days']))
+
+        max_batches = options['max_batches']
+        deleted = 0
+        batches = 0
+        cursor = None
+        started = time.monotonic()
+        try:
+            while not max_batches or batches < max_batches:
+                batch = stale.order_by('last_activity', 'pk')
+                if cursor is not None:
+                    # Keyset по (last_activity, id) идет по индексу и не
+                    # возвращается к строкам, которые не удалось удалить
+                    last_activity, pk = cursor
+                    batch = batch.filter(
+                        Q(last_activity__gt=last_activity)
+                        | Q(last_activity=last_activity, pk__gt=pk))
+                rows = list(batch.values_list(
+                    'last_activity', 'pk')[:options['batch_size']])
+                if not rows:
+                    break
+                cursor = rows[-1]
+
+                # Условие проверяется еще раз: пользователь мог зайти,
+                # пока пачка выбиралась
+                _, counts = stale.filter(
+                    pk__in=[pk for _, pk in rows]).delete()
+                deleted += counts.get(User._meta.label, 0)
+                batches += 1
+                self.report(deleted, batches, started)
+                time.sleep(options['sleep'])
+        except KeyboardInterrupt:
+            self.stderr.write('Прервано, повторный запуск продолжит удаление')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Удалено пользователей: {deleted}, пачек: {batches}'))
+
+    def report(self, deleted, batches, started):
+        elapsed = time.monotonic() - started
+        self.stdout.write(
+            f'Пачка {batches}: удалено {deleted}, '
+            f'{deleted / elapsed:.0f} строк/с')
@@ -1,4 +1,7 @@
 from django.contrib.auth.base_user import BaseUserManager
+from django.contrib.auth.hashers import UNUSABLE_PASSWORD_PREFIX
+from django.db import transaction
+from django.db.models import Q
 
 
 class CustomUserManager(BaseUserManager):
@@ -42,3 +45,79 @@ class CustomUserManager(BaseUserManager):
         )
         user.save(using=self._db)
         return user
+
+    def stale_anonymous(self, before):
+        """
+        Анонимные пользователи без почты и пароля, которые не заходили
+        с before. Условие совпадает с частичным индексом
+        customuser_stale_idx, поэтому выборка идет по индексу.
+        """
+
+        return self.filter(
+            Q(password='') | Q(password__startswith=UNUSABLE_PASSWORD_PREFIX),
+            email__isnull=True,
+            is_verified=False,
+            last_activity__lt=before,
+        )
+
+    def merge(self, source, target):
+        """
+        Переносит на target все, что ссылается на source, и удаляет
+        source. Каждая связь переносится одним UPDATE, без сохранения
+        строк по одной, поэтому объем связанных данных не важен.
+        Source должен быть анонимным, иначе ValueError.
+        """
+
+        with transaction.atomic(using=self.db):
+            # Блокируем обе строки, чтобы параллельное слияние
+            # не перенесло данные в уже удаленного пользователя
+            locked = {
+                user.pk: user
+                for user in self.select_for_update().filter(
+                    pk__in=(source.pk, target.pk))
+            }
+            # Проверяем заблокированную строку: пока шел запрос,
+            # source мог получить почту или пароль
+            if (source.pk not in locked
+                    or not locked[source.pk].is_anonymous_account):
+                raise ValueError(
+                    'Объединять можно только анонимного пользователя')
+
+            for field in self.model._meta.many_to_many:
+                self._merge_m2m(
+                    field.remote_field.through,
+                    field.m2m_field_name(),
+                    field.m2m_reverse_field_name(),
+                    source,
+                    target,
+                )
+
+            for relation in self.model._meta.related_objects:
+                if relation.many_to_many:
+                    self._merge_m2m(
+                        relation.through,
+                        relation.field.m2m_reverse_field_name(),
+                        relation.field.m2m_field_name(),
+                        source,
+                        target,
+                    )
+                    continue
+
+                manager = relation.related_model._base_manager.using(self.db)
+                name = relation.field.name
+                # Связь один к одному у target может быть уже занята,
+                # тогда строка source удалится вместе с ним
+                if (relation.one_to_one
+                        and manager.filter(**{name: target}).exists()):
+                    continue
+                manager.filter(**{name: source}).update(**{name: target})
+
+            source.delete()
+
+    def _merge_m2m(self, through, user_field, other_field, source, target):
+        manager = through._base_manager.using(self.db)
+        existing = manager.filter(**{user_field: target}).values(other_field)
+        # Связи, которые у target уже есть, удалятся вместе с source
+        manager.filter(**{user_field: source}).exclude(
+            **{f'{other_field}__in': existing},
+        ).update(**{user_field: target})
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.2 on 2026-10-18 17:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users_app', '0008_rename_date_of_birth_customuser_birthday_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customuser',
+            name='guest_id',
+            field=models.UUIDField(blank=True, editable=False, null=True, unique=True, verbose_name='Гостевой идентификатор'),
+        ),
+    ]
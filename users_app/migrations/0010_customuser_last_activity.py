@@ -0,0 +1,49 @@
+# Generated by Django 4.2.2 on 2026-10-18 17:09
+
+from datetime import datetime, timezone as dt_timezone
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+from django.db.models import Value
+from django.db.models.functions import Coalesce
+import django.utils.timezone
+
+# Активность тех, кто ни разу не входил, неизвестна: считаем ее
+# давней, иначе все такие строки получили бы время миграции и
+# delete_stale_users не тронул бы их еще days дней
+UNKNOWN_ACTIVITY = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def fill_last_activity(apps, schema_editor):
+    CustomUser = apps.get_model('users_app', 'CustomUser')
+    CustomUser.objects.filter(last_activity__isnull=True).update(
+        last_activity=Coalesce('last_login', Value(UNKNOWN_ACTIVITY)))
+
+
+class Migration(migrations.Migration):
+    # Индекс строится без блокировки записи в большую таблицу
+    atomic = False
+
+    dependencies = [
+        ('users_app', '0009_customuser_guest_id'),
+    ]
+
+    operations = [
+        # Сначала без значения по умолчанию, чтобы существующие строки
+        # заполнить по last_login, а не временем миграции
+        migrations.AddField(
+            model_name='customuser',
+            name='last_activity',
+            field=models.DateTimeField(editable=False, null=True, verbose_name='Последняя активность'),
+        ),
+        migrations.RunPython(fill_last_activity, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='customuser',
+            name='last_activity',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False, verbose_name='Последняя активность'),
+        ),
+        AddIndexConcurrently(
+            model_name='customuser',
+            index=models.Index(condition=models.Q(('email__isnull', True), ('is_verified', False)), fields=['last_activity', 'id'], name='customuser_stale_idx'),
+        ),
+    ]
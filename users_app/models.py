@@ -1,7 +1,8 @@
 from django.contrib.auth.base_user import AbstractBaseUser
 from django.contrib.auth.models import PermissionsMixin
 from django.db import models
-from django.db.models import UniqueConstraint
+from django.db.models import Q, UniqueConstraint
+from django.utils import timezone
 
 from users_app.managers import CustomUserManager
 
@@ -17,6 +18,14 @@ class CustomUser(AbstractBaseUser, PermissionsMixin):
                 name='unique_user',
             ),
         ]
+        indexes = [
+            # Для users_app.management.commands.delete_stale_users
+            models.Index(
+                fields=('last_activity', 'id'),
+                name='customuser_stale_idx',
+                condition=Q(email__isnull=True, is_verified=False),
+            ),
+        ]
 
     username = models.CharField(
         'username',
@@ -50,6 +59,19 @@ class CustomUser(AbstractBaseUser, PermissionsMixin):
         max_length=20,
         null=True,
     )
+    # Гость из api.backends.GuestUser, для которого создана строка
+    guest_id = models.UUIDField(
+        'Гостевой идентификатор',
+        unique=True,
+        null=True,
+        blank=True,
+        editable=False,
+    )
+    last_activity = models.DateTimeField(
+        'Последняя активность',
+        default=timezone.now,
+        editable=False,
+    )
     is_active = models.BooleanField(default=True)
     is_admin = models.BooleanField(default=False)
     is_verified = models.BooleanField(default=False)
@@ -68,3 +90,16 @@ class CustomUser(AbstractBaseUser, PermissionsMixin):
     @property
     def is_staff(self):
         return self.is_admin
+
+    @property
+    def is_anonymous_account(self):
+        """
+        Строка без своих учетных данных: нет почты, пароля и
+        подтверждения. Ее данные можно отдать другому пользователю.
+        """
+
+        return (
+            not self.email
+            and not self.is_verified
+            and (not self.password or not self.has_usable_password())
+        )